@@ -9,9 +9,10 @@ from telegram.constants import ParseMode
 import config
 from database import db
 from extractor import extractor
-from utils import is_owner
-import psutil
-import platform
+from utils import is_owner, format_file_size, format_time
+from login_sessions import user_sessions
+from broadcast import Broadcast
+from metrics import system_metrics
 from datetime import datetime
 
 # ===== ADMIN COMMANDS =====
@@ -125,12 +126,13 @@ async def get_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Bot statistics"""
+    import platform
     stats = await db.get_stats()
     
-    # Server stats
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    disk = psutil.disk_usage('/')
+    # Server stats from the background sampler, nothing here blocks the event loop
+    snapshot = await system_metrics.latest()
+    cpu_avg = system_metrics.average("cpu_percent", 60)
+    process = snapshot["process"]
     
     stats_msg = f"""📊 **Bot Statistics**
 
@@ -141,21 +143,103 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 📦 **Extractions:**
 • Total: {stats['total_extractions']}
+• Running: {len(extractor.jobs)}
+• Pending logins: {len(user_sessions)}/{user_sessions.max_pending}
 
 🖥️ **Server:**
-• CPU: {cpu_percent}%
-• RAM: {memory.percent}%
-• Disk: {disk.percent}%
+• CPU: {snapshot['cpu_percent']}% (1 min avg {cpu_avg or 0:.1f}%)
+• RAM: {snapshot['ram_percent']}%
+• Disk: {snapshot['disk_percent']}%
+• Network: ⬆️ {format_file_size(int(snapshot['net_sent_rate']))}/s ⬇️ {format_file_size(int(snapshot['net_recv_rate']))}/s
+• Bot process: {process['cpu_percent']}% CPU, {format_file_size(process['rss'])} RAM
 • Platform: {platform.system()}
 
 ⏰ **Uptime:**
-• Running smoothly 🟢
+• {format_time(int(process['uptime']))} 🟢
 
 **Powered by RATNA**
 """
     
     await update.message.reply_text(stats_msg, parse_mode=ParseMode.MARKDOWN)
 
+async def indexes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Index usage statistics (Owner only)"""
+    user_id = update.effective_user.id
+    
+    if not is_owner(user_id):
+        await update.message.reply_text("❌ This command is for owner only!")
+        return
+    
+    try:
+        stats = await db.get_index_stats()
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error: {str(e)}")
+        return
+    
+    msg = "🗂️ **Index Usage**\n"
+    for collection, indexes in sorted(stats.items()):
+        msg += f"\n`{collection}`:\n"
+        for index in sorted(indexes, key=lambda i: i['ops'], reverse=True):
+            since = index['since'].strftime('%Y-%m-%d') if index['since'] else '-'
+            unused = " ⚠️ unused" if index['ops'] == 0 else ""
+            msg += f"• `{index['name']}`: {index['ops']} ops since {since}{unused}\n"
+    
+    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Copy a message to every user (Owner only)"""
+    user_id = update.effective_user.id
+    
+    if not is_owner(user_id):
+        await update.message.reply_text("❌ This command is for owner only!")
+        return
+    
+    action = context.args[0].lower() if context.args else None
+    current = context.application.bot_data.get('broadcast')
+    running = current is not None and current.running
+    
+    if action == "status":
+        if not running:
+            await update.message.reply_text("ℹ️ No broadcast is running")
+        else:
+            await update.message.reply_text(current.status_text(), parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    if action == "cancel":
+        if not running:
+            await update.message.reply_text("ℹ️ No broadcast is running")
+        else:
+            await current.stop()
+        return
+    
+    if running:
+        await update.message.reply_text("⚠️ A broadcast is already running. Use /broadcast status or /broadcast cancel")
+        return
+    
+    if action == "resume":
+        record = await db.get_resumable_broadcast()
+        if not record:
+            await update.message.reply_text("ℹ️ Nothing to resume")
+            return
+    elif update.message.reply_to_message:
+        source = update.message.reply_to_message
+        total = await db.estimate_user_count()
+        record = await db.create_broadcast(user_id, source.chat_id, source.message_id, total)
+    else:
+        await update.message.reply_text(
+            "Usage:\n"
+            "• Reply to a message with /broadcast\n"
+            "• /broadcast status\n"
+            "• /broadcast cancel\n"
+            "• /broadcast resume"
+        )
+        return
+    
+    status_message = await update.message.reply_text("📢 Starting broadcast...")
+    broadcast = Broadcast(context.bot, record, status_message)
+    context.application.bot_data['broadcast'] = broadcast
+    broadcast.start()
+
 # ===== PREMIUM COMMANDS =====
 async def transfer_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Transfer premium to another user"""
@@ -361,8 +445,12 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("❌ Remove Thumbnail", callback_data="setting_removethumb")
         ],
         [
-            InlineKeyboardButton("📊 Video Watermark", callback_data="setting_watermark"),
-            InlineKeyboardButton("📤 Upload Method", callback_data="setting_upload")
+            InlineKeyboardButton("💧 Photo Watermark", callback_data="setting_watermark"),
+            InlineKeyboardButton("❌ Remove Watermark", callback_data="setting_removewatermark")
+        ],
+        [
+            InlineKeyboardButton("📤 Upload Method", callback_data="setting_upload"),
+            InlineKeyboardButton("♻️ Skip Duplicates", callback_data="setting_dedupe")
         ],
         [
             InlineKeyboardButton("⚠️ Report Errors", callback_data="setting_report")
@@ -398,13 +486,16 @@ async def speedtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Server speed test"""
     msg = await update.message.reply_text("⚡ Running speed test...")
     
+    import asyncio
     import time
-    start = time.time()
     
-    # Simple CPU test
-    _ = sum(i * i for i in range(1000000))
+    def cpu_test() -> float:
+        start = time.perf_counter()
+        _ = sum(i * i for i in range(1000000))
+        return time.perf_counter() - start
     
-    elapsed = time.time() - start
+    # Simple CPU test, in a thread so other users' updates keep flowing
+    elapsed = await asyncio.to_thread(cpu_test)
     
     # Network test (ping to Telegram)
     import aiohttp
@@ -417,22 +508,21 @@ async def speedtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             ping = 999
     
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
+    snapshot = await system_metrics.latest()
     
     result = f"""⚡ **Speed Test Results**
 
 🖥️ **CPU Test:**
 • Time: {elapsed:.2f}s
-• Usage: {cpu_percent}%
+• Usage: {snapshot['cpu_percent']}%
 
 🌐 **Network:**
 • Ping: {ping:.0f}ms
 • Status: {'🟢 Good' if ping < 200 else '🟡 Fair' if ping < 500 else '🔴 Slow'}
 
 💾 **Memory:**
-• Used: {memory.percent}%
-• Available: {memory.available / (1024**3):.1f} GB
+• Used: {snapshot['ram_percent']}%
+• Available: {snapshot['ram_available'] / (1024**3):.1f} GB
 
 **Server Status: 🟢 Optimal**
 """
@@ -1,6 +1,8 @@
 import asyncio
 import logging
 from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -12,11 +14,13 @@ from telegram.ext import (
     ConversationHandler
 )
 from telegram.constants import ParseMode
-from pyrogram import Client
-from pyrogram.errors import SessionPasswordNeeded, PhoneCodeInvalid, PhoneCodeExpired
 import config
 from database import db
 from extractor import extractor
+from peer_cache import peer_cache, chat_key
+from thumbnails import thumbnails, watermarks
+from tracing import format_trace_summary
+from watch import watches
 from utils import (
     parse_telegram_link,
     is_owner,
@@ -34,8 +38,8 @@ logger = logging.getLogger(__name__)
 # Conversation states
 PHONE, CODE, PASSWORD, BATCH_LINK, BATCH_COUNT = range(5)
 
-# User session data
-user_sessions = {}
+# Pending login data (expires after config.LOGIN_TTL)
+from login_sessions import user_sessions
 
 # ===== START & HELP COMMANDS =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -70,7 +74,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 **Extraction:**
 📦 `/batch` - Bulk extract messages from channel
+🧮 `/batch dry` - Estimate a batch without sending anything
 ❌ `/cancel` - Cancel ongoing extraction
+🔁 `/retry` - Re-run failed messages of your last batch
+🔍 `/trace` - Timing breakdown of your last job
+
+**Watch Mode:**
+👁️ `/watch [post link]` - Mirror every post after it as it is published
+📋 `/watch` - List your watches
+🛑 `/unwatch [post link]` - Stop watching a channel (`/unwatch all` stops every watch)
 
 **Downloads:**
 📥 `/dl [link]` - Download video from message
@@ -93,6 +105,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🗑️ `/rem [userID]` - Remove premium
 📋 `/get` - Get all user list
 📊 `/stats` - Bot statistics
+🗂️ `/indexes` - Database index usage
+📢 `/broadcast` - Reply to a message to send it to all users
+🔍 `/trace [userID] [jobID]` - Timing breakdown of a user's job
 
 **Other:**
 🔄 `/transfer [userID]` - Transfer your premium
@@ -144,9 +159,19 @@ async def phone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass
             del user_sessions[user_id]
     
+    # Cap open MTProto connections held by unfinished logins
+    if not client and user_sessions.is_full():
+        logger.warning(f"Pending login limit reached, rejecting login for user {user_id}")
+        await update.message.reply_text(
+            "⏳ Too many logins in progress right now.\n"
+            "Please try again in a few minutes with /login"
+        )
+        return ConversationHandler.END
+    
     try:
         if not client:
             # Create new client only if needed
+            from pyrogram import Client
             client = Client(
                 f"temp_{user_id}",
                 api_id=config.API_ID,
@@ -192,19 +217,27 @@ async def phone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "2. You have Telegram on this number\n"
             "3. Try again with /login"
         )
-        # Cleanup on error
+        # Cleanup on error; a client created above isn't in user_sessions yet
         if user_id in user_sessions:
+            stored = user_sessions[user_id]['client']
+            if stored is not client:
+                try:
+                    await stored.disconnect()
+                except:
+                    pass
+            del user_sessions[user_id]
+        if client:
             try:
-                await user_sessions[user_id]['client'].disconnect()
+                await client.disconnect()
             except:
                 pass
-            del user_sessions[user_id]
         return ConversationHandler.END
 
 
     
 async def code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle verification code"""
+    from pyrogram.errors import SessionPasswordNeeded, PhoneCodeInvalid, PhoneCodeExpired
     text = update.message.text.strip().replace(" ", "")
     user_id = update.effective_user.id
     
@@ -238,6 +271,8 @@ async def code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"Sign in successful for user {user_id}")
         except SessionPasswordNeeded:
             logger.info(f"2FA required for user {user_id}")
+            # Give the user a fresh TTL to type the password
+            user_sessions[user_id] = session
             await update.message.reply_text(
                 "🔒 **Two-Step Verification Enabled**\n\n"
                 "Please send your **Cloud Password** to complete login.",
@@ -251,6 +286,7 @@ async def code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Save to database
         await db.save_session(user_id, session_string, phone)
+        await peer_cache.forget_user(user_id)
         logger.info(f"Session saved to database for user {user_id}")
         
         # Disconnect and cleanup
@@ -335,6 +371,7 @@ async def password_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Save to database
         await db.save_session(user_id, session_string, session['phone'])
+        await peer_cache.forget_user(user_id)
         
         await client.disconnect()
         del user_sessions[user_id]
@@ -356,12 +393,19 @@ async def password_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             del user_sessions[user_id]
         return ConversationHandler.END
 
+async def logout_user(user_id: int):
+    """Drop the session and everything running on the user's client"""
+    await db.delete_session(user_id)
+    # Watches hang off the client's handlers, stop them before the client goes away
+    await watches.stop_user(user_id, "Logged out")
+    await extractor.cleanup_user_client(user_id)
+    await peer_cache.forget_user(user_id)
+
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /logout"""
     user_id = update.effective_user.id
     
-    await db.delete_session(user_id)
-    await extractor.cleanup_user_client(user_id)
+    await logout_user(user_id)
     
     await update.message.reply_text("✅ Logged out successfully!")
 
@@ -387,8 +431,14 @@ async def batch_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN
     )
     context.user_data['batch_tries'] = 0
+    # /batch dry only estimates the batch
+    context.user_data['batch_dry_run'] = bool(context.args) and context.args[0].lower() in ("dry", "estimate")
     return BATCH_LINK
 
+def prefetch_failed(task: asyncio.Task) -> bool:
+    """True when a finished batch prefetch reported an error to the user"""
+    return task.done() and not task.cancelled() and task.exception() is None and bool(task.result())
+
 async def batch_link_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle batch link"""
     link = update.message.text.strip()
@@ -413,6 +463,21 @@ async def batch_link_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['batch_start_msg'] = message_id
     context.user_data['batch_chat_type'] = chat_type
     
+    # Start the client, resolve the chat and fetch the first messages while the user types the count
+    async def prefetch():
+        error = await extractor.prefetch_batch(user_id, chat_id, message_id)
+        if error:
+            await update.message.reply_text(error)
+        return error
+    
+    task = context.application.create_task(prefetch())
+    context.user_data['batch_prefetch'] = task
+    
+    # Warm clients and resolved peers answer fast, report access errors before asking for the count
+    await asyncio.wait([task], timeout=1.5)
+    if prefetch_failed(task):
+        return ConversationHandler.END
+    
     # Get user limits
     is_premium = await db.check_premium(user_id)
     max_limit = await check_user_limit(user_id, is_premium)
@@ -448,41 +513,245 @@ async def batch_count_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("❌ Count must be greater than 0")
         return BATCH_COUNT
     
+    # Stop here if the prefetch already found the chat inaccessible
+    prefetch = context.user_data.pop('batch_prefetch', None)
+    if prefetch and prefetch_failed(prefetch):
+        await update.message.reply_text("❌ Batch cancelled. Fix the issue above and start again with /batch")
+        return ConversationHandler.END
+    
     # Start extraction
     chat_id = context.user_data['batch_chat_id']
     start_msg = context.user_data['batch_start_msg']
     
+    if context.user_data.pop('batch_dry_run', False):
+        status_msg = await update.message.reply_text("🧮 Reading message metadata...")
+        
+        async def run_estimate():
+            try:
+                report = await extractor.dry_run(user_id, chat_id, start_msg, count)
+            except Exception as e:
+                report = f"❌ Estimate failed: {str(e)}"
+            try:
+                await status_msg.edit_text(report, parse_mode=ParseMode.MARKDOWN)
+            except Exception as e:
+                # Error texts can carry stray Markdown, don't leave the user at "Reading..."
+                logger.warning(f"Dry run report for {user_id} not sent as Markdown: {e}")
+                await status_msg.edit_text(report)
+        
+        # Metadata for thousands of messages takes a while, don't hold up other updates
+        context.application.create_task(run_estimate())
+        return ConversationHandler.END
+    
     # Send initial progress message
     progress_msg = await update.message.reply_text(
         create_batch_progress_message(0, count),
         parse_mode=ParseMode.MARKDOWN
     )
     
-    # Progress callback
-    async def progress_callback(message, job_id=None, current=0, total=0, complete=False):
+    # Queue the job, any worker process (including this one) can claim it
+    await db.enqueue_job(
+        user_id, chat_id, start_msg, count,
+        progress_chat_id=progress_msg.chat_id,
+        progress_message_id=progress_msg.message_id
+    )
+    
+    worker = context.application.bot_data.get('job_worker')
+    if worker:
+        worker.notify()
+    
+    return ConversationHandler.END
+
+# ===== RETRY FAILED MESSAGES =====
+async def retry_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Re-run the messages that failed permanently in the user's last job"""
+    user_id = update.effective_user.id
+    
+    job = await db.claim_failed_job_for_retry(user_id)
+    if not job:
+        await update.message.reply_text("✅ No failed messages to retry!")
+        return
+    
+    message_ids = job['failed_message_ids']
+    progress_msg = await update.message.reply_text(
+        create_batch_progress_message(0, len(message_ids)),
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    await db.enqueue_job(
+        user_id, job['chat_id'], message_ids[0], len(message_ids),
+        destination_chat_id=job.get('destination_chat_id'),
+        progress_chat_id=progress_msg.chat_id,
+        progress_message_id=progress_msg.message_id,
+        message_ids=message_ids,
+        retry_of=job['_id']
+    )
+    
+    worker = context.application.bot_data.get('job_worker')
+    if worker:
+        worker.notify()
+
+# ===== JOB TRACE =====
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show timing breakdown of the user's last job, owner can pass /trace <userID> [jobID]"""
+    user_id = update.effective_user.id
+    target_id, job_id = user_id, None
+    
+    if context.args:
+        if not is_owner(user_id):
+            await update.message.reply_text("❌ Tracing other users' jobs is for owner only!")
+            return
         try:
-            if complete:
-                await progress_msg.edit_text(message, parse_mode=ParseMode.MARKDOWN)
-            else:
-                await progress_msg.edit_text(
-                    create_batch_progress_message(current, total),
-                    parse_mode=ParseMode.MARKDOWN
-                )
-        except Exception as e:
-            logger.error(f"Progress update error: {e}")
+            target_id = int(context.args[0])
+            job_id = ObjectId(context.args[1]) if len(context.args) > 1 else None
+        except (ValueError, InvalidId):
+            await update.message.reply_text("Usage: /trace <userID> [jobID]\nExample: /trace 123456789")
+            return
+    
+    if job_id:
+        job = await db.get_job_trace(target_id, job_id)
+    else:
+        job = await db.get_last_job_trace(target_id)
+    if not job and context.args:
+        await update.message.reply_text("❌ No traced job found for that user.")
+        return
+    if not job:
+        await update.message.reply_text("❌ No finished jobs found. Run /batch or /dl first.")
+        return
+    
+    created = job.get('created_at')
+    msg = (
+        f"🔍 **{'Job' if job_id else 'Last Job'} Trace**\n\n"
+        f"🆔 Job: `{job['_id']}`\n"
+        f"👤 User: `{target_id}`\n"
+        f"📦 Type: `{job.get('job_type')}`\n"
+        f"📌 Status: `{job.get('status')}`\n"
+        f"✔️ Processed: {job.get('processed', 0)}/{job.get('total_messages', 0)}\n"
+        f"📅 Started: {created.strftime('%Y-%m-%d %H:%M') if created else '-'}\n\n"
+        f"{format_trace_summary(job.get('trace'))}"
+    )
     
-    # Get user settings
-    settings = await db.get_settings(user_id)
+    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+
+# ===== WATCH MODE =====
+async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mirror new posts of a channel to the destination chat, or list the user's watches"""
+    user_id = update.effective_user.id
+    
+    if not context.args:
+        records = await db.get_watches(user_id)
+        if not records:
+            await update.message.reply_text(
+                "👁️ No watches yet.\n\n"
+                "Send `/watch <link to the latest post>` to mirror every new post of that channel.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+        lines = ["👁️ **Your Watches**\n"]
+        for i, record in enumerate(records, 1):
+            status = "🟢" if record.get('active') else "🔴"
+            lines.append(
+                f"{i}. {status} `{record['source']}` → `{record['destination']}`\n"
+                f"   Last post: {record.get('last_message_id', 0)} | "
+                f"Mirrored: {record.get('delivered', 0)} | Failed: {record.get('failed', 0)}"
+            )
+            if record.get('error'):
+                # Code span, raw errors contain underscores and brackets
+                error = record['error'].replace('`', "'")
+                lines.append(f"   ⚠️ `{error}`")
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    parsed = parse_telegram_link(context.args[0])
+    if not parsed:
+        await update.message.reply_text(
+            "❌ Invalid link.\n"
+            "Usage: /watch https://t.me/c/2342349151/1200\n"
+            "Posts after the linked one are mirrored."
+        )
+        return
+    chat_id, message_id, _ = parsed
     
-    # Start extraction in background
-    asyncio.create_task(
-        extractor.extract_messages(
-            user_id, chat_id, start_msg, count,
-            progress_callback, None, settings
+    # Restarting an existing watch doesn't count against the limit
+    is_premium = await db.check_premium(user_id)
+    max_watches = config.PREMIUM_MAX_WATCHES if is_premium else config.FREE_MAX_WATCHES
+    records = await db.get_watches(user_id)
+    others = [r for r in records if r.get('active') and r['source'] != chat_key(chat_id)]
+    if len(others) >= max_watches:
+        await update.message.reply_text(
+            f"❌ Limit exceeded! You can watch {max_watches} channel(s) at a time.\n"
+            f"Stop one with /unwatch or upgrade to premium: /plan"
         )
+        return
+    
+    settings = await db.get_settings(user_id)
+    destination = settings.get('chat_id') or user_id
+    error = await watches.add(user_id, chat_id, message_id, destination)
+    if error:
+        await update.message.reply_text(error)
+        return
+    
+    await update.message.reply_text(
+        f"👁️ **Watching** `{chat_key(chat_id)}`\n\n"
+        f"Posts after #{message_id} are mirrored to `{destination}` with your current settings.\n"
+        f"Stop with /unwatch",
+        parse_mode=ParseMode.MARKDOWN
     )
+
+async def unwatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop one watch, or all of them"""
+    user_id = update.effective_user.id
     
-    return ConversationHandler.END
+    if not context.args:
+        await update.message.reply_text("Usage: /unwatch [post link] or /unwatch all")
+        return
+    
+    if context.args[0].lower() == "all":
+        records = await db.get_watches(user_id)
+        for record in records:
+            await watches.remove(user_id, record['chat_id'])
+        await update.message.reply_text(f"✅ Stopped {len(records)} watch(es)")
+        return
+    
+    parsed = parse_telegram_link(context.args[0])
+    if not parsed:
+        await update.message.reply_text("❌ Invalid link. Usage: /unwatch [post link]")
+        return
+    
+    if await watches.remove(user_id, parsed[0]):
+        await update.message.reply_text("✅ Watch stopped")
+    else:
+        await update.message.reply_text("❌ You are not watching that channel. See /watch")
+
+# ===== CUSTOM THUMBNAIL & WATERMARK =====
+async def image_setting_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Save an image as thumbnail or watermark after the matching settings button was pressed"""
+    setting = context.user_data.pop('awaiting_image', None)
+    if setting not in ('thumbnail', 'watermark'):
+        return
+    
+    user_id = update.effective_user.id
+    msg = await update.message.reply_text(f"🖼️ Processing {setting}...")
+    
+    try:
+        # PNG watermarks keep their transparency when sent as a file
+        if update.message.document:
+            image_file = await update.message.document.get_file()
+        else:
+            image_file = await update.message.photo[-1].get_file()
+        data = await image_file.download_as_bytearray()
+        
+        # Processed once here, every upload after this reuses the cached file
+        store = thumbnails if setting == 'thumbnail' else watermarks
+        digest = await store.save(bytes(data))
+        await db.update_settings(user_id, **{setting: digest})
+        
+        if setting == 'thumbnail':
+            await msg.edit_text("✅ Thumbnail saved! It will be used for uploaded videos, audios and documents.")
+        else:
+            await msg.edit_text("✅ Watermark saved! It will be added to photos in your batches.")
+    except Exception as e:
+        logger.error(f"{setting.capitalize()} error for {user_id}: {e}")
+        await msg.edit_text(f"❌ Could not process this image: {str(e)}")
 
 # ===== CANCEL COMMAND =====
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -0,0 +1,172 @@
+"""
+Broadcast - Streams users from MongoDB and copies a message to them at the bot's global rate
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional, Set
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter
+import config
+from database import db
+from rate_limit import RateLimiter
+from utils import format_time
+
+logger = logging.getLogger(__name__)
+
+class Broadcast:
+    """
+    One running broadcast
+    A bounded queue feeds a fixed pool of senders, so memory stays flat no matter how many users
+    Progress is checkpointed as the highest user ID below which every user has been handled
+    """
+
+    def __init__(self, bot, record: dict, status_message=None):
+        self.bot = bot
+        self.record = record
+        self.status_message = status_message
+        self.limiter = RateLimiter(config.BROADCAST_RATE, burst=config.BROADCAST_WORKERS)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=config.BROADCAST_WORKERS * 2)
+        self.sent = record.get('sent', 0)
+        self.failed = record.get('failed', 0)
+        self.blocked = record.get('blocked', 0)
+        self.last_user_id = record.get('last_user_id', 0)
+        # Users queued or being sent, the checkpoint can't pass the smallest of them
+        self._pending: Set[int] = set()
+        self._dispatched = self.last_user_id
+        self._blocked_ids: List[int] = []
+        self._started = time.monotonic()
+        self._sent_at_start = self.sent
+        self._task: Optional[asyncio.Task] = None
+        self._stop_status = "cancelled"
+
+    @property
+    def broadcast_id(self):
+        return self.record['_id']
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def checkpoint_user_id(self) -> int:
+        if self._pending:
+            return min(self._pending) - 1
+        return self._dispatched
+
+    def status_text(self, title: str = "📢 **Broadcasting...**") -> str:
+        done = self.sent + self.failed + self.blocked
+        total = max(self.record.get('total', 0), done)
+        elapsed = time.monotonic() - self._started
+        rate = (self.sent - self._sent_at_start) / elapsed if elapsed > 0 else 0
+        eta = int((total - done) / rate) if rate > 0 else 0
+        return (
+            f"{title}\n\n"
+            f"✅ Sent: {self.sent}\n"
+            f"🚫 Blocked (removed): {self.blocked}\n"
+            f"❌ Failed: {self.failed}\n"
+            f"📊 Progress: {done}/{total}\n"
+            f"⚡ Speed: {rate:.1f} msg/s\n"
+            f"⏱️ ETA: {format_time(eta)}"
+        )
+
+    async def _producer(self):
+        cursor = db.iter_user_ids(self.last_user_id)
+        async for user in cursor:
+            user_id = user['user_id']
+            self._pending.add(user_id)
+            self._dispatched = user_id
+            await self.queue.put(user_id)
+
+    async def _sender(self):
+        while True:
+            user_id = await self.queue.get()
+            try:
+                await self._send(user_id)
+            finally:
+                self._pending.discard(user_id)
+                self.queue.task_done()
+
+    async def _send(self, user_id: int):
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.copy_message(
+                    user_id, self.record['from_chat_id'], self.record['message_id']
+                )
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                # Flood limit is per bot, hold every sender back
+                self.limiter.pause(e.retry_after)
+            except Forbidden:
+                self.blocked += 1
+                self._blocked_ids.append(user_id)
+                return
+            except Exception as e:
+                logger.warning(f"Broadcast to {user_id} failed: {e}")
+                self.failed += 1
+                return
+
+    async def _checkpoint(self, status: str = "running"):
+        blocked_ids, self._blocked_ids = self._blocked_ids, []
+        if blocked_ids:
+            await db.delete_blocked_users(blocked_ids)
+        await db.update_broadcast(
+            self.broadcast_id,
+            status=status,
+            last_user_id=self.checkpoint_user_id(),
+            sent=self.sent,
+            failed=self.failed,
+            blocked=self.blocked
+        )
+
+    async def _edit_status(self, text: str):
+        if not self.status_message:
+            return
+        try:
+            await self.status_message.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+        except Exception:
+            pass
+
+    async def _run(self):
+        senders = [asyncio.create_task(self._sender()) for _ in range(config.BROADCAST_WORKERS)]
+        producer = asyncio.create_task(self._producer())
+        status = "interrupted"
+        try:
+            while not producer.done():
+                await asyncio.wait([producer], timeout=config.BROADCAST_CHECKPOINT_INTERVAL)
+                await self._checkpoint()
+                await self._edit_status(self.status_text())
+            producer.result()
+            await self.queue.join()
+            status = "completed"
+        except asyncio.CancelledError:
+            status = self._stop_status
+        except Exception as e:
+            logger.error(f"Broadcast {self.broadcast_id} stopped: {e}")
+        finally:
+            producer.cancel()
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(producer, *senders, return_exceptions=True)
+            # Users still queued keep the checkpoint below them, resume sends to them again
+            await self._checkpoint(status)
+            titles = {
+                "completed": "✅ **Broadcast Complete!**",
+                "cancelled": "⛔ **Broadcast Cancelled**",
+                "interrupted": "⚠️ **Broadcast Interrupted** - /broadcast resume"
+            }
+            await self._edit_status(self.status_text(titles[status]))
+
+    async def stop(self, status: str = "cancelled"):
+        """Cancel the run; 'interrupted' keeps it resumable after a restart"""
+        if not self.running:
+            return
+        self._stop_status = status
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
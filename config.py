@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,16 +19,102 @@ MAX_CONCURRENT_EXTRACTIONS = 3
 PREMIUM_MAX_BATCH = 10000
 FREE_MAX_BATCH = 3
 
+# Job Queue Configuration (extraction_jobs is shared by every worker process)
+JOB_WORKER_ENABLED = os.getenv("JOB_WORKER_ENABLED", "true").lower() == "true"
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "20"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "3"))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "2"))  # running batches per user, across workers
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # claims of a job whose worker keeps dying
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "30"))  # finished jobs are deleted after this
+
 # Server Configuration (for Render deployment)
 PORT = int(os.getenv("PORT", "10000"))
-WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # For webhook mode if needed
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base URL, e.g. https://your-app.onrender.com (enables webhook mode)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Secret token Telegram sends back in every webhook request (A-Z, a-z, 0-9, _ and - only)
+# Derived from the bot token when not set, so every instance behind one URL agrees on it
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+
+# Startup Configuration
+# Fast startup: ensure Mongo indexes in the background instead of blocking boot on them
+FAST_STARTUP = os.getenv("FAST_STARTUP", "true").lower() == "true"
+
+# Retry Configuration
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "2"))  # seconds, doubled on every attempt
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))  # consecutive transient failures per source
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# Delivery Ledger - skip messages already delivered to the same destination
+DELIVERY_LEDGER = os.getenv("DELIVERY_LEDGER", "true").lower() == "true"
+
+# In-batch deduplication (enabled per user in settings)
+DEDUPE_MAX_KEYS = int(os.getenv("DEDUPE_MAX_KEYS", "100000"))  # files/texts remembered per job
+
+# Speculative prefetch while /batch waits for the count
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "50"))  # messages fetched after the link arrives
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "300"))  # seconds prefetched messages stay usable
+
+# Source message index - metadata of source chats, reused by later jobs and dry runs
+SOURCE_INDEX_MAX_AGE_DAYS = int(os.getenv("SOURCE_INDEX_MAX_AGE_DAYS", "14"))  # entries are refetched after this
+
+# Watch mode - mirrors new posts of a source chat as they are published
+WATCH_ENABLED = os.getenv("WATCH_ENABLED", "true").lower() == "true"  # run watches in this process
+FREE_MAX_WATCHES = int(os.getenv("FREE_MAX_WATCHES", "1"))
+PREMIUM_MAX_WATCHES = int(os.getenv("PREMIUM_MAX_WATCHES", "10"))
+WATCH_BURST_DELAY = float(os.getenv("WATCH_BURST_DELAY", "2"))  # seconds of quiet that end a burst (album parts arrive together)
+WATCH_BURST_MAX_WAIT = float(os.getenv("WATCH_BURST_MAX_WAIT", "10"))  # longest a post waits for its burst
+WATCH_BURST_SIZE = int(os.getenv("WATCH_BURST_SIZE", "100"))
+WATCH_CATCHUP_LIMIT = int(os.getenv("WATCH_CATCHUP_LIMIT", "1000"))  # most posts mirrored after downtime
+WATCH_RESTART_DELAY = float(os.getenv("WATCH_RESTART_DELAY", "30"))  # seconds before a failed watch starts again
+WATCH_LEASE_SECONDS = int(os.getenv("WATCH_LEASE_SECONDS", "60"))  # one process runs each watch, like job leases
+WATCH_HEARTBEAT_SECONDS = int(os.getenv("WATCH_HEARTBEAT_SECONDS", "20"))
+
+# Peer Cache Configuration
+ACCESS_FAILURE_TTL = int(os.getenv("ACCESS_FAILURE_TTL", "900"))  # seconds a failed chat access is remembered
 
 # File Configuration
 TEMP_DIR = "temp_downloads"
 MAX_FILE_SIZE = 2000 * 1024 * 1024  # 2GB max file size
+BOT_API_UPLOAD_LIMIT = 50 * 1024 * 1024  # Bot API rejects larger uploads
+UPLOAD_PART_SIZE = 512 * 1024  # MTProto maximum part size
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))  # parts uploaded in parallel per file
+
+# Watermark Configuration
+WATERMARK_WORKERS = int(os.getenv("WATERMARK_WORKERS", "2"))  # processes compositing photos
+WATERMARK_PIPELINE_DEPTH = int(os.getenv("WATERMARK_PIPELINE_DEPTH", "3"))  # photos in flight per job
+WATERMARK_SCALE = float(os.getenv("WATERMARK_SCALE", "0.25"))  # watermark width relative to the photo
+WATERMARK_OPACITY = float(os.getenv("WATERMARK_OPACITY", "0.6"))
 
 # Session Configuration
 SESSION_STRING_BOT = "extractor_bot_session"
+LOGIN_TTL = int(os.getenv("LOGIN_TTL", "600"))  # seconds an unfinished /login keeps its client
+MAX_PENDING_LOGINS = int(os.getenv("MAX_PENDING_LOGINS", "100"))
+LOGIN_REAP_INTERVAL = int(os.getenv("LOGIN_REAP_INTERVAL", "30"))
+
+# Premium Expiry Sweeper
+PREMIUM_SWEEP_INTERVAL = int(os.getenv("PREMIUM_SWEEP_INTERVAL", "300"))  # seconds between sweeps
+PREMIUM_SWEEP_BATCH = int(os.getenv("PREMIUM_SWEEP_BATCH", "500"))
+PREMIUM_NOTIFY_RATE = float(os.getenv("PREMIUM_NOTIFY_RATE", "10"))  # expiry messages per second
+
+# System Metrics Sampler
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "5"))  # seconds between samples
+METRICS_HISTORY = int(os.getenv("METRICS_HISTORY", "120"))  # samples kept in the ring buffer
+
+# Update Processing
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))  # updates handled in parallel across users
+
+# Event Loop Monitor
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # seconds between lag probes
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.3"))  # blocked loop logged with its stack
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "10"))  # handler runtime logged with its stack
+
+# Broadcast Configuration
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "28"))  # messages per second, Telegram allows ~30
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "20"))
+BROADCAST_CHECKPOINT_INTERVAL = int(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "5"))  # seconds
 
 # Admin Configuration
 ADMIN_IDS = [OWNER_ID]
@@ -1,23 +1,181 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import logging
+import uuid
 from datetime import datetime, timedelta
 import config
 
+logger = logging.getLogger(__name__)
+
 class Database:
     def __init__(self):
-        self.client = AsyncIOMotorClient(config.MONGO_URI)
-        self.db = self.client[config.DATABASE_NAME]
-        self.users = self.db.users
-        self.sessions = self.db.sessions
-        self.extraction_jobs = self.db.extraction_jobs
-        self.settings = self.db.settings
-        self.stats = self.db.stats
+        # Client is created lazily on first use, so it binds to the running event loop
+        # and importing this module doesn't pull in motor
+        self._client = None
+        self._db = None
+        self._collections = {}
+        self._index_task = None
+    
+    @property
+    def client(self):
+        """Motor client, created on first access"""
+        if self._client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._client = AsyncIOMotorClient(config.MONGO_URI)
+        return self._client
+    
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = self.client[config.DATABASE_NAME]
+        return self._db
+    
+    def _collection(self, name: str):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self.db[name]
+        return collection
+    
+    @property
+    def users(self):
+        return self._collection("users")
+    
+    @property
+    def sessions(self):
+        return self._collection("sessions")
+    
+    @property
+    def extraction_jobs(self):
+        return self._collection("extraction_jobs")
+    
+    @property
+    def settings(self):
+        return self._collection("settings")
+    
+    @property
+    def stats(self):
+        return self._collection("stats")
+    
+    @property
+    def peers(self):
+        return self._collection("peers")
+    
+    @property
+    def access_failures(self):
+        return self._collection("access_failures")
+    
+    @property
+    def thumbnails(self):
+        return self._collection("thumbnails")
+    
+    @property
+    def watermarks(self):
+        return self._collection("watermarks")
+    
+    @property
+    def broadcasts(self):
+        return self._collection("broadcasts")
+    
+    @property
+    def deliveries(self):
+        return self._collection("deliveries")
+    
+    @property
+    def message_index(self):
+        return self._collection("message_index")
+    
+    @property
+    def source_index_state(self):
+        return self._collection("source_index_state")
         
-    async def init_db(self):
-        """Initialize database indexes"""
-        await self.users.create_index("user_id", unique=True)
-        await self.sessions.create_index("user_id", unique=True)
-        await self.extraction_jobs.create_index("user_id")
-        await self.settings.create_index("user_id", unique=True)
+    @property
+    def watches(self):
+        return self._collection("watches")
+    
+    async def init_db(self, background: bool = False):
+        """Initialize database indexes (optionally without blocking startup)"""
+        if not background:
+            await self.ensure_indexes()
+            return
+        if self._index_task is None or self._index_task.done():
+            self._index_task = asyncio.create_task(self._ensure_indexes_background())
+    
+    async def ensure_indexes(self):
+        """Create database indexes"""
+        await asyncio.gather(
+            self.users.create_index("user_id", unique=True),
+            self.users.create_index([("is_premium", 1), ("premium_expiry", 1)]),
+            self.sessions.create_index("user_id", unique=True),
+            # Active job lookups and per-user history (trace, retry)
+            self.extraction_jobs.create_index([("user_id", 1), ("status", 1)]),
+            self.extraction_jobs.create_index([("user_id", 1), ("created_at", -1)]),
+            # Queue claims only ever look at unfinished jobs
+            self.extraction_jobs.create_index(
+                [("status", 1), ("created_at", 1)],
+                name="unfinished_jobs",
+                partialFilterExpression={"status": {"$in": ["queued", "active"]}}
+            ),
+            self._ensure_ttl_index(
+                self.extraction_jobs, "finished_at", "finished_jobs_ttl",
+                config.JOB_RETENTION_DAYS * 86400
+            ),
+            self.settings.create_index("user_id", unique=True),
+            self.peers.create_index([("user_id", 1), ("chat_key", 1)], unique=True),
+            self.access_failures.create_index([("user_id", 1), ("chat_key", 1)], unique=True),
+            self.access_failures.create_index("expires_at", expireAfterSeconds=0),
+            self.deliveries.create_index([("source", 1), ("destination", 1)], unique=True),
+            self.message_index.create_index([("source", 1), ("message_id", 1)], unique=True),
+            self._ensure_ttl_index(
+                self.message_index, "indexed_at", "message_index_ttl",
+                config.SOURCE_INDEX_MAX_AGE_DAYS * 86400
+            ),
+            self.source_index_state.create_index("source", unique=True),
+            self.watches.create_index([("user_id", 1), ("source", 1)], unique=True),
+            self.watches.create_index("active")
+        )
+        await self._drop_redundant_indexes()
+    
+    async def _ensure_ttl_index(self, collection, field: str, name: str, seconds: int):
+        """Create a TTL index, or update its expiry when the retention setting changed"""
+        from pymongo.errors import OperationFailure
+        try:
+            await collection.create_index(field, name=name, expireAfterSeconds=seconds)
+        except OperationFailure as e:
+            # IndexOptionsConflict: same index with a different expireAfterSeconds
+            if e.code != 85:
+                raise
+            await self.db.command(
+                "collMod", collection.name,
+                index={"name": name, "expireAfterSeconds": seconds}
+            )
+    
+    async def _drop_redundant_indexes(self):
+        """Drop indexes superseded by the compound and partial indexes above"""
+        existing = await self.extraction_jobs.index_information()
+        for name in ("user_id_1", "status_1_created_at_1"):
+            if name in existing:
+                await self.extraction_jobs.drop_index(name)
+    
+    async def get_index_stats(self):
+        """Index usage statistics ($indexStats) for every collection"""
+        stats = {}
+        for name in await self.db.list_collection_names():
+            cursor = self.db[name].aggregate([{"$indexStats": {}}])
+            stats[name] = [
+                {
+                    "name": index["name"],
+                    "ops": index.get("accesses", {}).get("ops", 0),
+                    "since": index.get("accesses", {}).get("since")
+                }
+                async for index in cursor
+            ]
+        return stats
+    
+    async def _ensure_indexes_background(self):
+        try:
+            await self.ensure_indexes()
+            logger.info("✅ Database indexes ensured")
+        except Exception as e:
+            logger.error(f"Index creation failed: {e}")
         
     # ===== USER MANAGEMENT =====
     async def add_user(self, user_id: int, username: str = None, first_name: str = None):
@@ -83,18 +241,47 @@ class Database:
         )
     
     async def check_premium(self, user_id: int):
-        """Check if user has active premium"""
-        user = await self.get_user(user_id)
+        """Check if user has active premium (read only, expiry is cleared by the sweeper)"""
+        user = await self.users.find_one(
+            {"user_id": user_id},
+            {"is_premium": 1, "premium_expiry": 1}
+        )
         if not user or not user.get("is_premium"):
             return False
         
         expiry = user.get("premium_expiry")
-        if expiry and expiry > datetime.utcnow():
-            return True
-        else:
-            # Premium expired, remove it
-            await self.remove_premium(user_id)
-            return False
+        return bool(expiry and expiry > datetime.utcnow())
+    
+    async def expire_premium_batch(self, limit: int):
+        """Clear premium for up to `limit` expired users, returns the IDs this call expired"""
+        now = datetime.utcnow()
+        expired_query = {
+            "is_premium": True,
+            "$or": [{"premium_expiry": {"$lt": now}}, {"premium_expiry": None}]
+        }
+        expired = await self.users.find(expired_query, {"user_id": 1}).limit(limit).to_list(None)
+        user_ids = [u["user_id"] for u in expired]
+        if not user_ids:
+            return []
+        
+        # Tag the update so concurrent sweepers on other instances don't notify twice
+        sweep_id = uuid.uuid4().hex
+        await self.users.update_many(
+            {"user_id": {"$in": user_ids}, **expired_query},
+            {
+                "$set": {
+                    "is_premium": False,
+                    "premium_expiry": None,
+                    "premium_expired_at": now,
+                    "expiry_sweep": sweep_id
+                }
+            }
+        )
+        swept = await self.users.find(
+            {"user_id": {"$in": user_ids}, "expiry_sweep": sweep_id},
+            {"user_id": 1}
+        ).to_list(None)
+        return [u["user_id"] for u in swept]
     
     async def transfer_premium(self, from_user: int, to_user: int):
         """Transfer premium from one user to another"""
@@ -132,6 +319,58 @@ class Database:
         """Delete user's session"""
         await self.sessions.delete_one({"user_id": user_id})
     
+    # ===== PEER CACHE =====
+    async def get_peers(self, user_id: int):
+        """Get all cached peers for user's client"""
+        return await self.peers.find({"user_id": user_id}).to_list(None)
+    
+    async def save_peer(self, user_id: int, chat_key: str, peer_id: int, access_hash: int,
+                        peer_type: str, username: str = None):
+        """Cache a resolved peer"""
+        await self.peers.update_one(
+            {"user_id": user_id, "chat_key": chat_key},
+            {
+                "$set": {
+                    "peer_id": peer_id,
+                    "access_hash": access_hash,
+                    "peer_type": peer_type,
+                    "username": username,
+                    "updated_at": datetime.utcnow()
+                }
+            },
+            upsert=True
+        )
+    
+    async def delete_user_peers(self, user_id: int):
+        """Forget cached peers and access failures for user"""
+        await self.peers.delete_many({"user_id": user_id})
+        await self.access_failures.delete_many({"user_id": user_id})
+    
+    async def get_access_failure(self, user_id: int, chat_key: str):
+        """Get a non-expired access failure"""
+        return await self.access_failures.find_one({
+            "user_id": user_id,
+            "chat_key": chat_key,
+            "expires_at": {"$gt": datetime.utcnow()}
+        })
+    
+    async def save_access_failure(self, user_id: int, chat_key: str, reason: str, ttl_seconds: int):
+        """Remember that user can't access a chat (expires via TTL index)"""
+        await self.access_failures.update_one(
+            {"user_id": user_id, "chat_key": chat_key},
+            {
+                "$set": {
+                    "reason": reason,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=ttl_seconds)
+                }
+            },
+            upsert=True
+        )
+    
+    async def delete_access_failure(self, user_id: int, chat_key: str):
+        """Forget an access failure once the user can reach the chat again"""
+        await self.access_failures.delete_one({"user_id": user_id, "chat_key": chat_key})
+    
     # ===== SETTINGS MANAGEMENT =====
     async def get_settings(self, user_id: int):
         """Get user settings"""
@@ -145,7 +384,10 @@ class Database:
                 "rename_format": None,
                 "thumbnail": None,
                 "watermark": None,
-                "replace_words": {}
+                "upload_method": "auto",
+                "dedupe": False,
+                "replace_words": {},
+                "remove_words": []
             }
             await self.settings.insert_one(settings)
         return settings
@@ -158,6 +400,30 @@ class Database:
             upsert=True
         )
     
+    async def save_thumbnail(self, digest: str, data: bytes):
+        """Store a processed thumbnail by its content hash"""
+        await self.thumbnails.update_one(
+            {"_id": digest},
+            {"$setOnInsert": {"data": data, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    async def get_thumbnail(self, digest: str):
+        """Get a processed thumbnail"""
+        return await self.thumbnails.find_one({"_id": digest})
+    
+    async def save_watermark(self, digest: str, data: bytes):
+        """Store a normalized watermark image by its content hash"""
+        await self.watermarks.update_one(
+            {"_id": digest},
+            {"$setOnInsert": {"data": data, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    async def get_watermark(self, digest: str):
+        """Get a normalized watermark image"""
+        return await self.watermarks.find_one({"_id": digest})
+    
     async def reset_settings(self, user_id: int):
         """Reset user settings to default"""
         await self.settings.delete_one({"user_id": user_id})
@@ -178,13 +444,193 @@ class Database:
         job["_id"] = result.inserted_id
         return job
     
-    async def update_job_progress(self, job_id, processed: int):
+    async def update_job_progress(self, job_id, processed: int, next_offset: int = None,
+                                  errors: int = None):
         """Update job progress"""
+        fields = {
+            "processed": processed,
+            "updated_at": datetime.utcnow()
+        }
+        if errors is not None:
+            fields["errors"] = errors
+        update = {"$set": fields}
+        if next_offset is not None:
+            update["$max"] = {"next_offset": next_offset}
+        await self.extraction_jobs.update_one({"_id": job_id}, update)
+    
+    async def finish_job(self, job_id, status: str = "completed"):
+        """Mark job as finished"""
+        await self.extraction_jobs.update_one(
+            {"_id": job_id, "status": "active"},
+            {
+                "$set": {
+                    "status": status,
+                    "finished_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+    
+    # ===== JOB QUEUE =====
+    async def enqueue_job(self, user_id: int, chat_id, start_message_id: int, count: int,
+                          destination_chat_id: int = None, progress_chat_id: int = None,
+                          progress_message_id: int = None, message_ids: list = None,
+                          retry_of=None):
+        """Queue a batch extraction for any worker to claim"""
+        job = {
+            "user_id": user_id,
+            "job_type": "batch_extraction",
+            "chat_id": chat_id,
+            "start_message_id": start_message_id,
+            "total_messages": count,
+            "destination_chat_id": destination_chat_id,
+            "progress_chat_id": progress_chat_id,
+            "progress_message_id": progress_message_id,
+            "message_ids": message_ids,
+            "retry_of": retry_of,
+            "processed": 0,
+            "errors": 0,
+            "next_offset": 0,
+            "attempts": 0,
+            "status": "queued",
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        result = await self.extraction_jobs.insert_one(job)
+        job["_id"] = result.inserted_id
+        return job
+    
+    async def _running_jobs_by_user(self) -> dict:
+        """user_id -> number of batches running under a live lease"""
+        cursor = self.extraction_jobs.aggregate([
+            {"$match": {
+                "job_type": "batch_extraction",
+                "status": "active",
+                "lease_expires_at": {"$gte": datetime.utcnow()}
+            }},
+            {"$group": {"_id": "$user_id", "running": {"$sum": 1}}}
+        ])
+        return {doc["_id"]: doc["running"] async for doc in cursor}
+    
+    async def claim_job(self, worker_id: str, lease_seconds: int):
+        """
+        Atomically claim a queued job or one whose lease has expired
+        Users with nothing running go first, then users below MAX_JOBS_PER_USER,
+        so one user's long queue can't hold every worker slot
+        """
+        await self._fail_exhausted_jobs()
+        running = await self._running_jobs_by_user()
+        passes = [list(running)]
+        at_limit = [user_id for user_id, count in running.items() if count >= config.MAX_JOBS_PER_USER]
+        if len(at_limit) < len(running):
+            passes.append(at_limit)
+        for excluded in passes:
+            job = await self._claim_job(worker_id, lease_seconds, excluded)
+            if job:
+                return job
+        return None
+    
+    async def _fail_exhausted_jobs(self):
+        """Fail jobs whose lease expired JOB_MAX_ATTEMPTS times, they crash every worker that runs them"""
+        now = datetime.utcnow()
+        await self.extraction_jobs.update_many(
+            {
+                "job_type": "batch_extraction",
+                "status": "active",
+                "lease_expires_at": {"$lt": now},
+                "attempts": {"$gte": config.JOB_MAX_ATTEMPTS}
+            },
+            {"$set": {"status": "failed", "finished_at": now, "updated_at": now}}
+        )
+    
+    async def _claim_job(self, worker_id: str, lease_seconds: int, excluded_users: list):
+        from pymongo import ReturnDocument
+        now = datetime.utcnow()
+        # Jobs handed back on shutdown are queued again, only expired leases use up attempts
+        query = {
+            "job_type": "batch_extraction",
+            "$or": [
+                {"status": "queued"},
+                {
+                    "status": "active",
+                    "lease_expires_at": {"$lt": now},
+                    "attempts": {"$lt": config.JOB_MAX_ATTEMPTS}
+                }
+            ]
+        }
+        if excluded_users:
+            query["user_id"] = {"$nin": excluded_users}
+        return await self.extraction_jobs.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "active",
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "claimed_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def renew_job_lease(self, job_id, worker_id: str, lease_seconds: int,
+                              next_offset: int = None) -> bool:
+        """Heartbeat for a claimed job, False if the lease was lost or job cancelled"""
+        now = datetime.utcnow()
+        update = {
+            "$set": {
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updated_at": now
+            }
+        }
+        if next_offset is not None:
+            update["$max"] = {"next_offset": next_offset}
+        result = await self.extraction_jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "active"},
+            update
+        )
+        return result.matched_count == 1
+    
+    async def release_job(self, job_id, worker_id: str):
+        """Hand a claimed job back to the queue (e.g. on shutdown)"""
+        await self.extraction_jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": "active"},
+            {
+                "$set": {"status": "queued", "updated_at": datetime.utcnow()},
+                "$unset": {"worker_id": "", "lease_expires_at": ""}
+            }
+        )
+    
+    async def save_job_failures(self, job_id, failed_message_ids: list):
+        """Store message IDs that failed permanently"""
         await self.extraction_jobs.update_one(
             {"_id": job_id},
+            {"$set": {"failed_message_ids": failed_message_ids, "updated_at": datetime.utcnow()}}
+        )
+    
+    async def claim_failed_job_for_retry(self, user_id: int):
+        """Get user's latest job with failed messages and mark it as retried"""
+        return await self.extraction_jobs.find_one_and_update(
+            {
+                "user_id": user_id,
+                "failed_message_ids.0": {"$exists": True},
+                "retried_at": {"$exists": False}
+            },
+            {"$set": {"retried_at": datetime.utcnow()}},
+            sort=[("created_at", -1)]
+        )
+    
+    async def cancel_user_jobs(self, user_id: int):
+        """Cancel all queued and active jobs for user"""
+        await self.extraction_jobs.update_many(
+            {"user_id": user_id, "status": {"$in": ["queued", "active"]}},
             {
                 "$set": {
-                    "processed": processed,
+                    "status": "cancelled",
+                    "finished_at": datetime.utcnow(),
                     "updated_at": datetime.utcnow()
                 }
             }
@@ -194,7 +640,7 @@ class Database:
         """Cancel extraction job"""
         await self.extraction_jobs.update_one(
             {"_id": job_id},
-            {"$set": {"status": "cancelled"}}
+            {"$set": {"status": "cancelled", "finished_at": datetime.utcnow()}}
         )
     
     async def get_active_job(self, user_id: int):
@@ -202,13 +648,182 @@ class Database:
         return await self.extraction_jobs.find_one(
             {"user_id": user_id, "status": "active"}
         )
+
+    async def save_job_trace(self, job_id, trace: dict):
+        """Store timing trace summary on the job"""
+        await self.extraction_jobs.update_one(
+            {"_id": job_id},
+            {
+                "$set": {
+                    "trace": trace,
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+
+    async def get_last_job_trace(self, user_id: int):
+        """Get the most recent job with a trace for user"""
+        return await self.extraction_jobs.find_one(
+            {"user_id": user_id, "trace": {"$exists": True}},
+            {"job_type": 1, "status": 1, "total_messages": 1, "processed": 1,
+             "created_at": 1, "trace": 1},
+            sort=[("created_at", -1)]
+        )
+    
+    async def get_job_trace(self, user_id: int, job_id):
+        """Get one job of a user with its trace"""
+        return await self.extraction_jobs.find_one(
+            {"_id": job_id, "user_id": user_id},
+            {"job_type": 1, "status": 1, "total_messages": 1, "processed": 1,
+             "created_at": 1, "trace": 1}
+        )
+    
+    # ===== DELIVERY LEDGER =====
+    async def get_delivery_ranges(self, source: str, destination: str):
+        """Message ID ranges already delivered from source to destination"""
+        return await self.deliveries.find_one({"source": source, "destination": destination})
+    
+    async def save_delivery_ranges(self, source: str, destination: str, ranges: list, version: int) -> bool:
+        """
+        Replace the delivered ranges only if nobody saved since they were read at version
+        Returns False on a conflict, the caller re-reads and merges again
+        """
+        from pymongo.errors import DuplicateKeyError
+        # Version 0 is a pair that was never saved (or saved before versions existed)
+        query = {"source": source, "destination": destination,
+                 "version": version if version else {"$in": [0, None]}}
+        try:
+            result = await self.deliveries.update_one(
+                query,
+                {"$set": {"ranges": ranges, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another job created or advanced the document first
+            return False
+        return result.matched_count > 0 or result.upserted_id is not None
+    
+    # ===== SOURCE MESSAGE INDEX =====
+    async def save_message_index(self, source: str, entries: list):
+        """Upsert message metadata of a source chat and advance its high-water mark"""
+        if not entries:
+            return
+        from pymongo import UpdateOne
+        now = datetime.utcnow()
+        await self.message_index.bulk_write([
+            UpdateOne(
+                {"source": source, "message_id": entry["message_id"]},
+                {"$set": {**entry, "source": source, "indexed_at": now}},
+                upsert=True
+            )
+            for entry in entries
+        ], ordered=False)
+        # High-water mark is the newest message that exists, IDs above it may simply not be posted yet
+        existing = [entry["message_id"] for entry in entries if entry["type"] != "missing"]
+        update = {"$set": {"updated_at": now}}
+        if existing:
+            update["$max"] = {"high_water": max(existing)}
+        await self.source_index_state.update_one({"source": source}, update, upsert=True)
+    
+    async def get_message_index(self, source: str, message_ids: list, fields: dict = None):
+        """Indexed metadata for the given message IDs of a source chat"""
+        cursor = self.message_index.find(
+            {"source": source, "message_id": {"$in": message_ids}},
+            fields or {"_id": 0, "source": 0, "indexed_at": 0}
+        )
+        return await cursor.to_list(None)
+    
+    async def get_source_index_state(self, source: str):
+        """High-water mark of a source chat's index"""
+        return await self.source_index_state.find_one({"source": source})
+    
+    # ===== WATCH MODE =====
+    async def save_watch(self, user_id: int, source: str, chat_id, destination: int, last_message_id: int,
+                         owner: str = None, lease_seconds: int = 0):
+        """
+        Start (or restart) mirroring a source chat after last_message_id
+        Leased to owner right away, or left for a process running watches to claim
+        """
+        from pymongo import ReturnDocument
+        now = datetime.utcnow()
+        return await self.watches.find_one_and_update(
+            {"user_id": user_id, "source": source},
+            {
+                "$set": {
+                    "chat_id": chat_id,
+                    "destination": destination,
+                    "last_message_id": last_message_id,
+                    "active": True,
+                    "error": None,
+                    "owner": owner,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds) if owner else None,
+                    "updated_at": now
+                },
+                "$setOnInsert": {"delivered": 0, "failed": 0, "created_at": now}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def update_watch(self, user_id: int, source: str, owner: str = None, **fields) -> bool:
+        """Checkpoint a watch's last mirrored ID and counters, False if owner no longer holds it"""
+        fields["updated_at"] = datetime.utcnow()
+        query = {"user_id": user_id, "source": source}
+        if owner:
+            query.update(owner=owner, active=True)
+        result = await self.watches.update_one(query, {"$set": fields})
+        return result.matched_count == 1
+    
+    async def claim_watch(self, owner: str, lease_seconds: int):
+        """Atomically take an active watch nobody runs, or one whose owner stopped renewing"""
+        from pymongo import ReturnDocument
+        now = datetime.utcnow()
+        return await self.watches.find_one_and_update(
+            {"active": True, "$or": [{"owner": None}, {"lease_expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds)}},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def renew_watch_lease(self, user_id: int, source: str, owner: str, lease_seconds: int) -> bool:
+        """Heartbeat for a running watch, False if it was removed, stopped or taken over"""
+        result = await self.watches.update_one(
+            {"user_id": user_id, "source": source, "owner": owner, "active": True},
+            {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+        )
+        return result.matched_count == 1
+    
+    async def release_watches(self, owner: str):
+        """Hand this process's watches back on shutdown, another process can claim them at once"""
+        await self.watches.update_many(
+            {"owner": owner},
+            {"$set": {"owner": None, "lease_expires_at": None}}
+        )
+    
+    async def get_watches(self, user_id: int):
+        """Every watch of a user, active or stopped"""
+        return await self.watches.find({"user_id": user_id}).sort("created_at", 1).to_list(None)
+    
+    async def delete_watch(self, user_id: int, source: str) -> bool:
+        result = await self.watches.delete_one({"user_id": user_id, "source": source})
+        return result.deleted_count > 0
+    
+    async def deactivate_user_watches(self, user_id: int, error: str):
+        """Stop every watch of a user, e.g. on logout; /watch starts them again"""
+        await self.watches.update_many(
+            {"user_id": user_id, "active": True},
+            {"$set": {"active": False, "error": error, "updated_at": datetime.utcnow()}}
+        )
     
     # ===== STATISTICS =====
     async def get_stats(self):
         """Get bot statistics"""
         total_users = await self.users.count_documents({})
         premium_users = await self.users.count_documents({"is_premium": True})
-        total_extractions = await self.extraction_jobs.count_documents({})
+        # Finished jobs expire from extraction_jobs, the per-user counters keep the lifetime total
+        totals = await self.users.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$total_extractions"}}}
+        ]).to_list(1)
+        total_extractions = totals[0]["total"] if totals else 0
         
         return {
             "total_users": total_users,
@@ -224,6 +839,59 @@ class Database:
             {"$inc": {field: 1}}
         )
     
+    async def estimate_user_count(self) -> int:
+        """Fast user count from collection metadata"""
+        return await self.users.estimated_document_count()
+    
+    def iter_user_ids(self, after_user_id: int = 0, batch_size: int = 500):
+        """Cursor over user IDs in ascending order, served by the unique user_id index"""
+        return self.users.find(
+            {"user_id": {"$gt": after_user_id}},
+            {"_id": 0, "user_id": 1}
+        ).sort("user_id", 1).batch_size(batch_size)
+    
+    async def delete_blocked_users(self, user_ids: list) -> int:
+        """Remove users who blocked the bot, premium users are kept"""
+        if not user_ids:
+            return 0
+        result = await self.users.delete_many({
+            "user_id": {"$in": user_ids},
+            "is_premium": {"$ne": True}
+        })
+        await self.settings.delete_many({"user_id": {"$in": user_ids}})
+        return result.deleted_count
+    
+    async def create_broadcast(self, owner_id: int, from_chat_id: int, message_id: int, total: int):
+        """Record a new broadcast"""
+        broadcast = {
+            "owner_id": owner_id,
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "total": total,
+            "last_user_id": 0,
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "status": "running",
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        result = await self.broadcasts.insert_one(broadcast)
+        broadcast['_id'] = result.inserted_id
+        return broadcast
+    
+    async def update_broadcast(self, broadcast_id, **fields):
+        """Checkpoint broadcast progress"""
+        fields["updated_at"] = datetime.utcnow()
+        await self.broadcasts.update_one({"_id": broadcast_id}, {"$set": fields})
+    
+    async def get_resumable_broadcast(self):
+        """Latest broadcast that didn't finish (interrupted by a restart or crash)"""
+        return await self.broadcasts.find_one(
+            {"status": {"$in": ["running", "interrupted"]}},
+            sort=[("created_at", -1)]
+        )
+    
     async def get_all_users(self):
         """Get all user IDs (for owner)"""
         users = await self.users.find({}, {"user_id": 1, "username": 1, "is_premium": 1}).to_list(None)
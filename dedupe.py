@@ -0,0 +1,57 @@
+"""
+In-batch deduplication - Skips files and text posts a job has already sent
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+WHITESPACE = re.compile(r'\s+')
+
+def _digest(kind: str, value: str) -> bytes:
+    # 8-byte keys keep 100k entries in a few MB
+    return hashlib.blake2b(f"{kind}:{value}".encode(), digest_size=8).digest()
+
+def content_key(message: "Message") -> Optional[Tuple[bytes, int]]:
+    """(key, size in bytes) identifying a message's content, None if it can't be deduplicated"""
+    if message.media:
+        media = getattr(message, message.media.value, None)
+        unique_id = getattr(media, 'file_unique_id', None)
+        if not unique_id:
+            return None
+        return _digest("file", unique_id), getattr(media, 'file_size', 0) or 0
+    if message.text:
+        normalized = WHITESPACE.sub(' ', message.text).strip().casefold()
+        if not normalized:
+            return None
+        return _digest("text", normalized), 0
+    return None
+
+class DedupeFilter:
+    """Memory-bounded set of content already sent in this job, oldest keys are evicted first"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+        self.skipped = 0
+        self.bytes_saved = 0
+
+    def is_duplicate(self, key: Tuple[bytes, int]) -> bool:
+        """Count and report a duplicate, without marking new content as seen"""
+        digest, size = key
+        if digest not in self._seen:
+            return False
+        self._seen.move_to_end(digest)
+        self.skipped += 1
+        self.bytes_saved += size
+        return True
+
+    def add(self, key: Tuple[bytes, int]):
+        """Mark content as sent, only after it was actually delivered"""
+        self._seen[key[0]] = None
+        if len(self._seen) > self.max_keys:
+            self._seen.popitem(last=False)
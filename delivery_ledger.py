@@ -0,0 +1,133 @@
+"""
+Delivery ledger - Message IDs already delivered from a source chat to a destination
+Stored as run-length ranges so overlapping or repeated batches skip what was already sent
+"""
+
+from bisect import bisect_right
+from typing import Iterable, List, Optional
+from database import db
+from peer_cache import chat_key
+
+class RangeSet:
+    """Sorted, non-overlapping inclusive [start, end] ranges of message IDs"""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, ranges: Optional[Iterable[Iterable[int]]] = None):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for start, end in sorted(tuple(r) for r in ranges or []):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __len__(self):
+        """Number of IDs covered"""
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    def add(self, value: int) -> bool:
+        """Add one ID, merging neighbouring ranges; False if it was already present"""
+        i = bisect_right(self.starts, value)
+        if i and value <= self.ends[i - 1]:
+            return False
+        joins_left = i > 0 and self.ends[i - 1] == value - 1
+        joins_right = i < len(self.starts) and self.starts[i] == value + 1
+        if joins_left and joins_right:
+            self.ends[i - 1] = self.ends[i]
+            del self.starts[i], self.ends[i]
+        elif joins_left:
+            self.ends[i - 1] = value
+        elif joins_right:
+            self.starts[i] = value
+        else:
+            self.starts.insert(i, value)
+            self.ends.insert(i, value)
+        return True
+
+    def discard(self, value: int):
+        """Remove one ID, splitting its range if needed"""
+        i = bisect_right(self.starts, value) - 1
+        if i < 0 or value > self.ends[i]:
+            return
+        start, end = self.starts[i], self.ends[i]
+        if start == end:
+            del self.starts[i], self.ends[i]
+        elif value == start:
+            self.starts[i] = value + 1
+        elif value == end:
+            self.ends[i] = value - 1
+        else:
+            self.ends[i] = value - 1
+            self.starts.insert(i + 1, value + 1)
+            self.ends.insert(i + 1, end)
+
+    def to_list(self) -> List[List[int]]:
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+class DeliveryLedger:
+    """
+    Ledger of one (source, destination) pair, loaded once per job
+    Jobs and watches on the same pair run concurrently, so saves merge this ledger's
+    changes into the stored ranges instead of replacing them
+    """
+
+    def __init__(self, source, destination, ranges: Optional[list] = None):
+        self.source = chat_key(source)
+        self.destination = chat_key(destination)
+        self.delivered = RangeSet(ranges)
+        # Stored ranges as last read or written, and their version for compare-and-set
+        self._stored: List[List[int]] = self.delivered.to_list()
+        self.version = 0
+        # IDs recorded since the last save
+        self._added = RangeSet()
+
+    @classmethod
+    async def load(cls, source, destination) -> "DeliveryLedger":
+        ledger = cls(source, destination)
+        doc = await db.get_delivery_ranges(ledger.source, ledger.destination)
+        if doc:
+            ledger.delivered = RangeSet(doc.get('ranges'))
+            ledger._stored = ledger.delivered.to_list()
+            ledger.version = doc.get('version', 0)
+        return ledger
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self.delivered
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._added.starts)
+
+    def record(self, message_id: int):
+        if self.delivered.add(message_id):
+            self._added.add(message_id)
+
+    async def save(self):
+        """Merge recorded IDs into the stored ranges, re-reading them when another job saved first"""
+        if not self.dirty:
+            return
+        # Records made while this save is waiting on Mongo go into the next save
+        added, self._added = self._added, RangeSet()
+        ranges, version = self._stored, self.version
+        try:
+            while True:
+                merged = RangeSet(list(ranges) + added.to_list())
+                if await db.save_delivery_ranges(self.source, self.destination, merged.to_list(), version):
+                    break
+                doc = await db.get_delivery_ranges(self.source, self.destination)
+                ranges = (doc.get('ranges') or []) if doc else []
+                version = doc.get('version', 0) if doc else 0
+        except BaseException:
+            # Keep the changes for the next save
+            self._added = RangeSet(added.to_list() + self._added.to_list())
+            raise
+        self._stored = merged.to_list()
+        self.version = version + 1
+        # Also skip what other jobs delivered meanwhile
+        self.delivered = RangeSet(self._stored + self._added.to_list())
@@ -0,0 +1,85 @@
+"""
+Batch estimator - Dry run of a /batch that reads message metadata only, from the source index where possible
+"""
+
+from typing import Dict, List, Optional, TYPE_CHECKING
+from delivery_ledger import DeliveryLedger, RangeSet
+from source_index import MISSING, get_metadata
+from utils import format_file_size, format_time
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+
+# Used when this instance hasn't delivered anything yet (copy time plus the 0.5s throttle)
+DEFAULT_SECONDS_PER_MESSAGE = 1.0
+
+async def estimate_batch(client: "Client", chat_id, message_ids: List[int], user_id: int,
+                         destination=None, seconds_per_message: Optional[float] = None) -> dict:
+    """Count what a batch would send, without copying or downloading anything"""
+    by_type: Dict[str, int] = {}
+    total_bytes = 0
+    albums = set()
+    missing = RangeSet()
+    ledger = await DeliveryLedger.load(chat_id, destination) if destination else None
+    already_delivered = 0
+
+    metadata, fetched = await get_metadata(client, chat_id, message_ids, user_id)
+    for message_id in message_ids:
+        entry = metadata[message_id]
+        if entry["type"] == MISSING:
+            missing.add(message_id)
+            continue
+        if ledger and message_id in ledger:
+            already_delivered += 1
+            continue
+        kind = entry["type"]
+        total_bytes += entry.get("size") or 0
+        by_type[kind] = by_type.get(kind, 0) + 1
+        if entry.get("media_group_id"):
+            albums.add(entry["media_group_id"])
+
+    to_send = sum(by_type.values())
+    measured = seconds_per_message is not None
+    return {
+        "total": len(message_ids),
+        "to_send": to_send,
+        "by_type": by_type,
+        "bytes": total_bytes,
+        "albums": len(albums),
+        "missing": missing,
+        "already_delivered": already_delivered,
+        "from_index": len(message_ids) - fetched,
+        "eta": int(to_send * (seconds_per_message if measured else DEFAULT_SECONDS_PER_MESSAGE)),
+        "eta_measured": measured
+    }
+
+def format_estimate(estimate: dict) -> str:
+    """Dry run report for Telegram"""
+    lines = [
+        "🧮 **Batch Estimate (dry run)**",
+        "",
+        f"📝 Requested: {estimate['total']}",
+        f"📤 Would send: {estimate['to_send']}"
+    ]
+    for kind, count in sorted(estimate['by_type'].items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  • `{kind}`: {count}")
+    lines.append(f"🗂️ Albums: {estimate['albums']}")
+    lines.append(f"💾 Media size: {format_file_size(estimate['bytes'])}")
+    if estimate['already_delivered']:
+        lines.append(f"⏭️ Already delivered: {estimate['already_delivered']}")
+
+    missing = estimate['missing']
+    if len(missing):
+        ranges = missing.to_list()
+        shown = ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges[:10])
+        more = f" ... +{len(ranges) - 10} ranges" if len(ranges) > 10 else ""
+        lines.append(f"❓ Missing/deleted: {len(missing)} (`{shown}`{more})")
+
+    if estimate['from_index']:
+        lines.append(f"📇 From index: {estimate['from_index']}/{estimate['total']}")
+
+    basis = "measured on this server" if estimate['eta_measured'] else "rough, no recent jobs"
+    lines.append(f"⏱️ ETA: {format_time(estimate['eta'])} ({basis})")
+    lines.append("")
+    lines.append("Nothing was copied. Run /batch to start.")
+    return "\n".join(lines)
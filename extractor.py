@@ -1,37 +1,104 @@
 import asyncio
+import os
+import shutil
 import time
-from pyrogram import Client
-from pyrogram.types import Message
-from pyrogram.errors import FloodWait, UserNotParticipant, ChannelPrivate
-from typing import Optional, Dict, Callable
+from typing import Optional, Dict, Callable, List, Tuple, TYPE_CHECKING
 import config
 from database import db
 from utils import (
     create_progress_message, 
     format_file_size, 
     sanitize_filename,
-    apply_rename_format,
-    apply_caption_format
+    format_failed_ids,
+    check_user_limit
 )
+from transforms import TransformPlan
+from peer_cache import peer_cache, chat_key, ACCESS_ERRORS
+from retry import RetryQueue, CircuitBreaker, classify_error, ACCESS, TRANSIENT
+from job_registry import JobRegistry
+from thumbnails import thumbnails, watermarks
+from watermark import WatermarkPipeline
+from uploader import upload_with_client
+from delivery_ledger import DeliveryLedger
+from dedupe import content_key
+import source_index
+from estimator import estimate_batch, format_estimate
+from tracing import (
+    JobTrace,
+    NullTrace,
+    ThroughputMeter,
+    STAGE_GET_MESSAGES,
+    STAGE_COPY,
+    STAGE_FORWARD,
+    STAGE_DOWNLOAD,
+    STAGE_UPLOAD,
+    STAGE_DB_WRITE,
+    STAGE_PROGRESS,
+    STAGE_FLOOD_WAIT,
+    STAGE_THROTTLE,
+    STAGE_RETRY_WAIT,
+    STAGE_BREAKER_WAIT
+)
+
+# Pyrogram is imported where it is first needed to keep bot startup fast
+if TYPE_CHECKING:
+    from pyrogram import Client
+    from pyrogram.types import Message
+
+# _process_message results
+SENT = "sent"
+MISSING = "missing"
+DUPLICATE = "duplicate"
+# Handed to the watermark pipeline, delivered (or failed) later through its on_done callback
+QUEUED = "queued"
+
+def media_metadata(message: "Message") -> dict:
+    """Attributes to keep when the file is uploaded again"""
+    media = message.video or message.audio or message.document or message.animation
+    return {
+        "file_name": getattr(media, 'file_name', None),
+        "duration": getattr(media, 'duration', None),
+        "width": getattr(media, 'width', None),
+        "height": getattr(media, 'height', None),
+        "performer": getattr(media, 'performer', None),
+        "title": getattr(media, 'title', None)
+    }
 
 class ContentExtractor:
     """Main content extraction handler"""
     
     def __init__(self):
-        self.active_extractions: Dict[int, bool] = {}
-        self.user_clients: Dict[int, Client] = {}
+        self.jobs = JobRegistry()
+        # Delivery speed of recent jobs, used for dry run ETAs
+        self.throughput = ThroughputMeter()
+        # (user_id, chat key, message_id) -> (monotonic expiry, message) fetched ahead of the job
+        self.prefetched: Dict[Tuple[int, str, int], Tuple[float, "Message"]] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.user_clients: Dict[int, "Client"] = {}
+        # One client start per user at a time, see get_user_client
+        self._client_locks: Dict[int, asyncio.Lock] = {}
     
-    async def get_user_client(self, user_id: int) -> Optional[Client]:
+    async def get_user_client(self, user_id: int) -> Optional["Client"]:
         """Get or create Pyrogram client for user"""
         if user_id in self.user_clients:
             return self.user_clients[user_id]
         
+        # Prefetch, queued jobs and restored watches can ask at the same time;
+        # they wait for the first start instead of connecting the same session twice
+        lock = self._client_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if user_id in self.user_clients:
+                return self.user_clients[user_id]
+            return await self._start_user_client(user_id)
+    
+    async def _start_user_client(self, user_id: int) -> Optional["Client"]:
         # Get session from database
         session_data = await db.get_session(user_id)
         if not session_data:
             return None
         
         try:
+            from pyrogram import Client
             client = Client(
                 f"user_{user_id}",
                 api_id=config.API_ID,
@@ -40,6 +107,12 @@ class ContentExtractor:
             )
             await client.start()
             self.user_clients[user_id] = client
+            
+            # Known peers survive restarts, so repeated sources skip the resolve call
+            try:
+                await peer_cache.restore(user_id, client)
+            except Exception as e:
+                print(f"Error restoring peers for {user_id}: {e}")
             return client
         except Exception as e:
             print(f"Error creating user client: {e}")
@@ -53,7 +126,8 @@ class ContentExtractor:
         count: int,
         progress_callback: Callable,
         destination_chat_id: Optional[int] = None,
-        settings: Optional[dict] = None
+        settings: Optional[dict] = None,
+        job: Optional[dict] = None
     ):
         """
         Extract and forward/download messages from a channel/group
@@ -66,112 +140,485 @@ class ContentExtractor:
             progress_callback: Async function to call with progress updates
             destination_chat_id: Where to forward messages (None = send to user)
             settings: User settings for caption, rename, etc.
+            job: Queued job claimed by a worker (resumes from its saved offset)
         """
+        from pyrogram.errors import FloodWait, UserNotParticipant, ChannelPrivate
+        active = None
+        plan = None
         try:
             # Get user client
             client = await self.get_user_client(user_id)
             if not client:
+                if job:
+                    await db.finish_job(job['_id'], "failed")
                 await progress_callback("❌ Please login first using /login", None)
                 return
             
-            # Mark extraction as active
-            self.active_extractions[user_id] = True
+            # Fail early for chats this user can't access
+            access_error = await peer_cache.check_access(user_id, client, chat_id)
+            if access_error:
+                await self._fail_job(job)
+                await progress_callback(access_error, None)
+                return
             
             # Get settings
             settings = settings or await db.get_settings(user_id)
             destination = destination_chat_id or settings.get('chat_id') or user_id
             
-            # Create job in database
-            job = await db.create_job(user_id, "batch_extraction", count)
+            # Create job in database, or resume a claimed one
+            if not job:
+                job = await db.create_job(user_id, "batch_extraction", count)
+            start_offset = job.get('next_offset', 0)
+            
+            processed = job.get('processed', 0)
+            errors = job.get('errors', 0)
+            trace = JobTrace()
+            plan = await self.build_plan(user_id, settings, trace)
+            
+            # Register with its own cancel token, /cancel aborts the in-flight transfer
+            active = self.jobs.register(job['_id'], user_id, "batch_extraction")
+            
+            # Messages this source already delivered to this destination are skipped
+            ledger = await DeliveryLedger.load(chat_id, destination) if config.DELIVERY_LEDGER else None
+            skipped = 0
+            
+            message_ids = job.get('message_ids')
+            failed_ids = list(job.get('failed_message_ids', []))
+            
+            # Metadata of fetched messages goes into the source index, known deleted IDs are skipped
+            plan.index = source_index.IndexBuffer(chat_id, user_id)
+            remaining_ids = message_ids[start_offset:] if message_ids else list(
+                range(start_message_id + start_offset, start_message_id + count)
+            )
+            plan.known_missing = await source_index.known_missing(chat_id, remaining_ids, user_id)
+            self._drop_prefetched(user_id, chat_id, remaining_ids)
+            retries = RetryQueue(config.RETRY_MAX_ATTEMPTS, config.RETRY_BASE_DELAY, config.RETRY_MAX_DELAY)
+            breaker = self._get_breaker(chat_id)
+            
+            # message ID -> index of photos in the watermark pipeline; a cancelled or crashed job
+            # never records them, so the next batch sends them again
+            queued_photos: Dict[int, int] = {}
             
-            processed = 0
-            errors = 0
+            def photo_done(message_id: int, uploaded: bool):
+                queued_photos.pop(message_id, None)
+                if uploaded and ledger:
+                    ledger.record(message_id)
             
-            for i in range(count):
-                # Check if cancelled
-                if not self.active_extractions.get(user_id):
-                    await progress_callback("❌ Extraction cancelled by user", job['_id'])
-                    break
+            if plan.watermark:
+                plan.watermark.on_done = photo_done
+            
+            async def attempt(i: int, attempts: int):
+                """Process one message, queue it for a retry or record it as failed"""
+                nonlocal processed, errors, skipped
+                message_id = message_ids[i] if message_ids else start_message_id + i
+                if ledger and message_id in ledger:
+                    skipped += 1
+                    return
                 
-                message_id = start_message_id + i
+                # Let an open circuit cool down before touching the source again
+                wait = breaker.wait_time()
+                if wait:
+                    with trace.span(STAGE_BREAKER_WAIT):
+                        await asyncio.sleep(wait)
                 
+                started = time.perf_counter()
                 try:
-                    # Get message
-                    message = await client.get_messages(chat_id, message_id)
-                    
-                    if not message or message.empty:
-                        errors += 1
-                        continue
-                    
-                    # Process based on message type
-                    if message.media:
-                        await self._handle_media_message(
-                            client, message, destination, user_id, settings, i
-                        )
-                    else:
-                        # Forward text message
-                        await client.forward_messages(
-                            destination, chat_id, message_id
+                    with trace.message(message_id):
+                        result = await self._process_message(
+                            client, chat_id, message_id, destination,
+                            user_id, settings, i, trace, plan
                         )
+                    breaker.record_success()
+                    if result == MISSING:
+                        errors += 1
+                        return
+                    if result == DUPLICATE:
+                        # Its content is in the destination already, saved with the next write
+                        if ledger:
+                            ledger.record(message_id)
+                        return
                     
                     processed += 1
+                    if result == QUEUED:
+                        # Recorded in the ledger by photo_done once it is uploaded
+                        queued_photos[message_id] = i
                     
                     # Update progress
-                    await db.update_job_progress(job['_id'], processed)
-                    await progress_callback(
-                        f"Processing: {processed}/{count}",
-                        job['_id'],
-                        processed,
-                        count
-                    )
+                    with trace.span(STAGE_DB_WRITE):
+                        if ledger:
+                            if result == SENT:
+                                ledger.record(message_id)
+                            await asyncio.gather(
+                                db.update_job_progress(job['_id'], processed, job['next_offset'], errors),
+                                ledger.save()
+                            )
+                        else:
+                            await db.update_job_progress(job['_id'], processed, job['next_offset'], errors)
+                    with trace.span(STAGE_PROGRESS):
+                        await progress_callback(
+                            f"Processing: {processed}/{count}",
+                            job['_id'],
+                            processed,
+                            count
+                        )
                     
                     # Small delay to avoid flood
-                    await asyncio.sleep(0.5)
+                    with trace.span(STAGE_THROTTLE):
+                        await asyncio.sleep(0.5)
+                    self.throughput.record(time.perf_counter() - started)
                     
                 except FloodWait as e:
-                    await asyncio.sleep(e.value)
-                    continue
+                    with trace.span(STAGE_FLOOD_WAIT):
+                        await asyncio.sleep(e.value)
+                    if not retries.push(i, attempts + 1, delay=0):
+                        errors += 1
+                        failed_ids.append(message_id)
                 except Exception as e:
-                    print(f"Error processing message {message_id}: {e}")
+                    kind = classify_error(e)
+                    if kind == ACCESS:
+                        # Every remaining message would fail too
+                        raise
+                    print(f"Error processing message {message_id} ({kind}): {e}")
+                    if kind == TRANSIENT:
+                        breaker.record_failure()
+                        if retries.push(i, attempts + 1):
+                            return
                     errors += 1
-                    continue
+                    failed_ids.append(message_id)
+            
+            def resume_offset(finished: int) -> int:
+                """Offset a resumed job starts from, never past a message that is in flight or waiting for a retry"""
+                waiting = retries.lowest_index()
+                if queued_photos:
+                    lowest_photo = min(queued_photos.values())
+                    waiting = lowest_photo if waiting is None else min(waiting, lowest_photo)
+                return finished if waiting is None else min(finished, waiting)
+            
+            # The heartbeat and progress writes save job['next_offset'];
+            # the ledger skips whatever was already sent when a job resumes a little early
+            job['next_offset'] = start_offset
+            for i in range(start_offset, count):
+                await attempt(i, 1)
+                job['next_offset'] = resume_offset(i + 1)
+                for retry_index, attempts in retries.pop_ready():
+                    await attempt(retry_index, attempts)
+                job['next_offset'] = resume_offset(i + 1)
+            
+            # Drain retries that are still backing off
+            while retries:
+                with trace.span(STAGE_RETRY_WAIT):
+                    await asyncio.sleep(retries.next_delay())
+                for retry_index, attempts in retries.pop_ready():
+                    await attempt(retry_index, attempts)
+                job['next_offset'] = resume_offset(count)
+            
+            if plan.watermark:
+                await plan.watermark.flush()
+                # Photos that failed after they were counted as processed
+                failed_photos = plan.watermark.failed_ids
+                processed -= len(failed_photos)
+                errors += len(failed_photos)
+                failed_ids.extend(failed_photos)
+            if ledger:
+                await ledger.save()
+            await plan.index.flush()
+            
+            if failed_ids:
+                await db.save_job_failures(job['_id'], failed_ids)
+            await db.save_job_trace(job['_id'], trace.summary())
+            await db.finish_job(job['_id'], "completed")
             
             # Cleanup
-            self.active_extractions[user_id] = False
+            self.jobs.unregister(job['_id'])
             await db.increment_user_stat(user_id, "total_extractions")
             
             # Send completion message
+            dedupe_line = ""
+            if plan.dedupe:
+                dedupe_line = (
+                    f"♻️ Duplicates skipped: {plan.dedupe.skipped} "
+                    f"({format_file_size(plan.dedupe.bytes_saved)} saved)\n"
+                )
             completion_msg = f"""✅ **Extraction Complete!**
 
 📊 **Statistics:**
 ✔️ Processed: {processed}
 ❌ Failed: {errors}
+⏭️ Already delivered: {skipped}
+{dedupe_line}🔁 Retries: {retries.retried}
 📝 Total: {count}
-
+{format_failed_ids(failed_ids)}
 **Powered by RATNA**"""
             
             await progress_callback(completion_msg, job['_id'], processed, count, True)
             
+        except asyncio.CancelledError:
+            if not (active and active.cancelled):
+                # Shutdown, leave the job for another worker to resume
+                raise
+            active.acknowledge_cancel()
+            await db.save_job_trace(job['_id'], trace.summary())
+            await progress_callback("❌ Extraction cancelled by user", job['_id'])
         except ChannelPrivate:
-            await progress_callback("❌ This is a private channel. Please login first using /login", None)
+            await self._fail_job(job)
+            await peer_cache.deny(user_id, chat_id, "private")
+            await progress_callback(ACCESS_ERRORS["private"], None)
         except UserNotParticipant:
-            await progress_callback("❌ You are not a member of this channel/group", None)
+            await self._fail_job(job)
+            await peer_cache.deny(user_id, chat_id, "not_participant")
+            await progress_callback(ACCESS_ERRORS["not_participant"], None)
         except Exception as e:
             print(f"Extraction error: {e}")
+            await self._fail_job(job)
             await progress_callback(f"❌ Error: {str(e)}", None)
         finally:
-            self.active_extractions[user_id] = False
+            if plan and plan.watermark:
+                plan.watermark.cancel()
+            if plan and plan.index:
+                try:
+                    await plan.index.flush()
+                except Exception as e:
+                    print(f"Error saving source index: {e}")
+            if active:
+                self.jobs.unregister(active.job_id)
+    
+    async def build_plan(self, user_id: int, settings: dict, trace: JobTrace) -> TransformPlan:
+        """Compile captions, renames and word lists once, and resolve the thumbnail and watermark"""
+        plan = TransformPlan(settings)
+        try:
+            plan.thumb_path = await thumbnails.get_path(settings.get('thumbnail'))
+        except Exception as e:
+            print(f"Error loading thumbnail for {user_id}: {e}")
+        
+        # Photo posts are watermarked in the process pool while the next messages download
+        try:
+            watermark_path = await watermarks.get_path(settings.get('watermark'))
+        except Exception as e:
+            watermark_path = None
+            print(f"Error loading watermark for {user_id}: {e}")
+        if watermark_path:
+            plan.watermark = WatermarkPipeline(watermark_path, trace, config.WATERMARK_PIPELINE_DEPTH)
+        return plan
+    
+    async def prefetch_batch(self, user_id: int, chat_id: int | str, start_message_id: int) -> Optional[str]:
+        """
+        Warm up a batch while the user is still typing the count
+        Starts the client, resolves the peer and fetches the first messages; returns an error message if the batch can't run
+        """
+        try:
+            client = await self.get_user_client(user_id)
+            if not client:
+                return "❌ Please login first using /login"
+            
+            access_error = await peer_cache.check_access(user_id, client, chat_id, recheck=True)
+            if access_error:
+                return access_error
+            
+            # Nothing past the user's batch limit can be part of the job
+            limit = await check_user_limit(user_id, await db.check_premium(user_id))
+            message_ids = list(range(start_message_id, start_message_id + min(config.PREFETCH_COUNT, limit)))
+            messages = await client.get_messages(chat_id, message_ids)
+            
+            await source_index.record(chat_id, [
+                source_index.describe(message_id, message, user_id)
+                for message_id, message in zip(message_ids, messages)
+            ])
+            
+            now = time.monotonic()
+            for key in [k for k, (expires, _) in self.prefetched.items() if expires <= now]:
+                del self.prefetched[key]
+            key_chat = chat_key(chat_id)
+            for message in messages:
+                if message and not message.empty:
+                    self.prefetched[(user_id, key_chat, message.id)] = (now + config.PREFETCH_TTL, message)
+        except Exception as e:
+            # Only a head start, the job fetches whatever is missing
+            print(f"Prefetch error for {user_id}: {e}")
+        return None
+    
+    def _take_prefetched(self, user_id: int, chat_id: int | str, message_id: int) -> Optional["Message"]:
+        entry = self.prefetched.pop((user_id, chat_key(chat_id), message_id), None)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def _drop_prefetched(self, user_id: int, chat_id: int | str, message_ids: list):
+        """Free the user's prefetched messages this job won't take, e.g. past the count they chose"""
+        key_chat = chat_key(chat_id)
+        wanted = set(message_ids)
+        for key in [k for k in self.prefetched if k[:2] == (user_id, key_chat) and k[2] not in wanted]:
+            del self.prefetched[key]
+    
+    async def dry_run(self, user_id: int, chat_id: int | str, start_message_id: int, count: int) -> str:
+        """Estimate a batch from message metadata, nothing is copied or downloaded"""
+        client = await self.get_user_client(user_id)
+        if not client:
+            return "❌ Please login first using /login"
+        
+        access_error = await peer_cache.check_access(user_id, client, chat_id, recheck=True)
+        if access_error:
+            return access_error
+        
+        settings = await db.get_settings(user_id)
+        destination = settings.get('chat_id') or user_id
+        message_ids = list(range(start_message_id, start_message_id + count))
+        estimate = await estimate_batch(
+            client, chat_id, message_ids, user_id,
+            destination=destination if config.DELIVERY_LEDGER else None,
+            seconds_per_message=self.throughput.seconds_per_message()
+        )
+        return format_estimate(estimate)
+    
+    def _get_breaker(self, chat_id) -> CircuitBreaker:
+        """Circuit breaker shared by all jobs reading from one source"""
+        key = chat_key(chat_id)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(
+                config.BREAKER_THRESHOLD, config.BREAKER_COOLDOWN
+            )
+        return breaker
+    
+    async def _process_message(
+        self,
+        client: "Client",
+        chat_id: int | str,
+        message_id: int,
+        destination: int,
+        user_id: int,
+        settings: dict,
+        index: int,
+        trace: JobTrace,
+        plan: TransformPlan
+    ) -> str:
+        """Fetch one message and send it on, returns SENT, QUEUED, MISSING or DUPLICATE"""
+        if message_id in plan.known_missing:
+            return MISSING
+        
+        message = self._take_prefetched(user_id, chat_id, message_id)
+        if message is None:
+            with trace.span(STAGE_GET_MESSAGES):
+                message = await client.get_messages(chat_id, message_id)
+            if plan.index is not None:
+                plan.index.add(message_id, message)
+                if plan.index.full:
+                    with trace.span(STAGE_DB_WRITE):
+                        await plan.index.flush()
+        
+        if not message or message.empty:
+            return MISSING
+        return await self.send_message(client, message, destination, user_id, settings, index, trace, plan)
+    
+    async def send_message(
+        self,
+        client: "Client",
+        message: "Message",
+        destination: int,
+        user_id: int,
+        settings: dict,
+        index: int,
+        trace: JobTrace,
+        plan: TransformPlan
+    ) -> str:
+        """Send an already fetched message through the job's transforms, returns SENT, QUEUED or DUPLICATE"""
+        # Same file or text already sent earlier in this job
+        key = content_key(message) if plan.dedupe else None
+        if key and plan.dedupe.is_duplicate(key):
+            return DUPLICATE
+        
+        # Keep destination order, anything that isn't a watermarked photo waits for pending photos
+        if plan.watermark and not message.photo:
+            await plan.watermark.flush()
+        
+        # Process based on message type
+        result = SENT
+        if message.media:
+            result = await self._handle_media_message(
+                client, message, destination, user_id, settings, index, trace, plan
+            )
+        elif plan.words and message.text:
+            # Rewrite text with replace/remove words, entities survive the round trip through HTML
+            from pyrogram.enums import ParseMode
+            with trace.span(STAGE_COPY):
+                await client.send_message(
+                    destination, plan.text_html(message.text.html), parse_mode=ParseMode.HTML
+                )
+        else:
+            # Forward text message
+            with trace.span(STAGE_FORWARD):
+                await client.forward_messages(
+                    destination, message.chat.id, message.id
+                )
+        if key:
+            plan.dedupe.add(key)
+        return result
+    
+    async def send_media_group(
+        self,
+        client: "Client",
+        messages: List["Message"],
+        destination: int,
+        index: int,
+        trace: JobTrace,
+        plan: TransformPlan
+    ) -> bool:
+        """
+        Copy a whole album as one album, False when the plan needs its posts sent one by one
+        (renamed files, custom thumbnails, watermarked photos or duplicates)
+        """
+        if plan.rename:
+            return False
+        if plan.thumb_path and not all(message.photo for message in messages):
+            return False
+        if plan.watermark and any(message.photo for message in messages):
+            return False
+        keys = [content_key(message) for message in messages] if plan.dedupe else []
+        if any(key and plan.dedupe.is_duplicate(key) for key in keys):
+            return False
+        
+        # Keep destination order behind photos still being watermarked
+        if plan.watermark:
+            await plan.watermark.flush()
+        
+        captions = []
+        for i, message in enumerate(messages):
+            media = message.document or message.video or message.audio
+            file_name = getattr(media, 'file_name', None) or ''
+            file_size = getattr(media, 'file_size', 0)
+            captions.append(plan.caption(message.caption, file_name, file_size, index + i) or "")
+        with trace.span(STAGE_COPY):
+            await client.copy_media_group(
+                destination, messages[0].chat.id, messages[0].id, captions=captions
+            )
+        for key in keys:
+            if key:
+                plan.dedupe.add(key)
+        return True
+    
+    async def _fail_job(self, job: Optional[dict]):
+        """Mark job failed so it isn't picked up again after its lease expires"""
+        if not job:
+            return
+        try:
+            await db.finish_job(job['_id'], "failed")
+        except Exception as e:
+            print(f"Error marking job failed: {e}")
     
     async def _handle_media_message(
         self,
-        client: Client,
-        message: Message,
+        client: "Client",
+        message: "Message",
         destination: int,
         user_id: int,
         settings: dict,
-        index: int
-    ):
-        """Handle media message with custom settings"""
+        index: int,
+        trace: Optional[JobTrace] = None,
+        plan: Optional[TransformPlan] = None
+    ) -> str:
+        """Handle media message with custom settings, returns SENT or QUEUED"""
+        from pyrogram.errors import FloodWait
+        trace = trace or NullTrace()
+        plan = plan or TransformPlan(settings)
         try:
             # Get original filename
             if message.document:
@@ -184,39 +631,69 @@ class ContentExtractor:
                 original_name = f"photo_{index}.jpg"
             else:
                 # Just forward if no special handling needed
-                await message.forward(destination)
-                return
-            
-            # Apply rename format if set
-            rename_format = settings.get('rename_format')
-            if rename_format:
-                file_name = apply_rename_format(original_name, rename_format, index)
-            else:
-                file_name = original_name
+                with trace.span(STAGE_FORWARD):
+                    await message.forward(destination)
+                return SENT
             
-            # Apply custom caption if set
-            custom_caption = settings.get('custom_caption')
+            # Apply rename format and caption from the compiled plan
+            file_name = plan.file_name(original_name, index)
             file_size = getattr(message.document or message.video or message.audio, 'file_size', 0)
+            caption = plan.caption(message.caption, file_name, file_size, index)
             
-            if custom_caption:
-                caption = apply_caption_format(custom_caption, file_name, file_size, index)
-            else:
-                caption = message.caption
+            if message.photo and plan.watermark:
+                work_dir = os.path.join(config.TEMP_DIR, f"wm_{user_id}_{message.id}")
+                await plan.watermark.submit(message, destination, caption, work_dir)
+                return QUEUED
             
-            # Get custom thumbnail if set
-            thumb = settings.get('thumbnail')
+            # A custom thumbnail only applies to uploaded files, copies keep the original one
+            if plan.thumb_path and not message.photo:
+                await self._reupload_with_thumb(
+                    message, destination, user_id, file_name, caption, plan.thumb_path, trace
+                )
+                return SENT
             
             # Copy message with modifications
-            await message.copy(
-                destination,
-                caption=caption,
-                file_name=file_name
-            )
+            with trace.span(STAGE_COPY):
+                await message.copy(
+                    destination,
+                    caption=caption,
+                    file_name=file_name
+                )
             
+        except FloodWait:
+            raise
         except Exception as e:
             print(f"Error handling media: {e}")
             # Fallback to simple forward
-            await message.forward(destination)
+            with trace.span(STAGE_FORWARD):
+                await message.forward(destination)
+        return SENT
+    
+    async def _reupload_with_thumb(
+        self,
+        message: "Message",
+        destination: int,
+        user_id: int,
+        file_name: str,
+        caption: Optional[str],
+        thumb_path: str,
+        trace: JobTrace
+    ):
+        """Download a media message and upload it again with the user's thumbnail"""
+        work_dir = os.path.join(config.TEMP_DIR, f"{user_id}_{message.id}")
+        try:
+            with trace.span(STAGE_DOWNLOAD):
+                file_path = await message.download(file_name=os.path.join(work_dir, file_name))
+            
+            meta = media_metadata(message)
+            meta['file_name'] = file_name
+            kind = 'video' if message.video else 'audio' if message.audio else 'document'
+            with trace.span(STAGE_UPLOAD):
+                await upload_with_client(
+                    message._client, destination, file_path, kind, caption, thumb_path, meta
+                )
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
     
     async def download_media(
         self,
@@ -224,8 +701,9 @@ class ContentExtractor:
         message_url: str,
         progress_callback: Callable,
         download_type: str = 'video'  # 'video' or 'audio'
-    ):
-        """Download media from message URL"""
+    ) -> Optional[Tuple[str, dict]]:
+        """Download media from message URL, returns the file path and media metadata for the upload"""
+        active = None
         try:
             client = await self.get_user_client(user_id)
             if not client:
@@ -240,10 +718,15 @@ class ContentExtractor:
                 return None
             
             chat_id, message_id, _ = parsed
+            trace = JobTrace()
+            job = await db.create_job(user_id, f"{download_type}_download", 1)
+            active = self.jobs.register(job['_id'], user_id, f"{download_type}_download")
             
             # Get message
-            message = await client.get_messages(chat_id, message_id)
+            with trace.span(STAGE_GET_MESSAGES):
+                message = await client.get_messages(chat_id, message_id)
             if not message or not message.media:
+                await db.finish_job(job['_id'], "failed")
                 await progress_callback("❌ No media found in this message")
                 return None
             
@@ -267,38 +750,59 @@ class ContentExtractor:
                 progress_msg = create_progress_message(
                     current, total, current, total, speed, eta
                 )
-                await progress_callback(progress_msg, current, total)
+                with trace.span(STAGE_PROGRESS):
+                    await progress_callback(progress_msg, current, total)
             
             # Download file
-            file_path = await message.download(
-                file_name=f"downloads/",
-                progress=download_progress
-            )
+            try:
+                with trace.message(message_id), trace.span(STAGE_DOWNLOAD):
+                    file_path = await message.download(
+                        file_name=f"downloads/",
+                        progress=download_progress
+                    )
+            finally:
+                await db.save_job_trace(job['_id'], trace.summary())
             
+            await db.finish_job(job['_id'], "completed" if file_path else "failed")
             await db.increment_user_stat(user_id, "total_downloads")
             
-            return file_path
+            if not file_path:
+                return None
+            return file_path, media_metadata(message)
             
+        except asyncio.CancelledError:
+            if not (active and active.cancelled):
+                raise
+            active.acknowledge_cancel()
+            await progress_callback("❌ Download cancelled")
+            return None
         except Exception as e:
             print(f"Download error: {e}")
+            if active:
+                await self._fail_job({'_id': active.job_id})
             await progress_callback(f"❌ Download failed: {str(e)}")
             return None
+        finally:
+            if active:
+                self.jobs.unregister(active.job_id)
     
     async def cancel_extraction(self, user_id: int):
-        """Cancel active extraction for user"""
-        self.active_extractions[user_id] = False
-        job = await db.get_active_job(user_id)
-        if job:
-            await db.cancel_job(job['_id'])
+        """Cancel active and queued extractions for user"""
+        # Mark cancelled in the database first so the job isn't finished as completed
+        # Workers in other processes notice on their next lease heartbeat
+        await db.cancel_user_jobs(user_id)
+        self.jobs.cancel_user(user_id)
     
     async def cleanup_user_client(self, user_id: int):
         """Stop and remove user client"""
-        if user_id in self.user_clients:
-            try:
-                await self.user_clients[user_id].stop()
-            except:
-                pass
-            del self.user_clients[user_id]
+        # Waits for a start in flight, so logout can't leave a freshly started client behind
+        async with self._client_locks.setdefault(user_id, asyncio.Lock()):
+            if user_id in self.user_clients:
+                try:
+                    await self.user_clients[user_id].stop()
+                except:
+                    pass
+                del self.user_clients[user_id]
 
 # Global extractor instance
 extractor = ContentExtractor()
@@ -0,0 +1,148 @@
+"""
+Job queue worker - Claims batch extractions from Mongo with a lease and runs them
+Any number of bot or worker processes can share one extraction_jobs collection
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, Optional
+from telegram.constants import ParseMode
+import config
+from database import db
+from extractor import extractor
+from utils import create_batch_progress_message
+
+logger = logging.getLogger(__name__)
+
+def make_progress_callback(bot, chat_id: Optional[int], message_id: Optional[int]):
+    """Progress callback that edits the job's progress message through the bot"""
+    async def progress_callback(message, job_id=None, current=0, total=0, complete=False):
+        if not chat_id or not message_id:
+            return
+        try:
+            # Errors are sent without totals, show them as they are
+            text = message if complete or not total else create_batch_progress_message(current, total)
+            await bot.edit_message_text(
+                text,
+                chat_id=chat_id,
+                message_id=message_id,
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except Exception as e:
+            logger.error(f"Progress update error: {e}")
+
+    return progress_callback
+
+class JobWorker:
+    """Claims queued jobs and keeps their leases alive while they run"""
+
+    def __init__(self, bot, max_jobs: int = config.MAX_CONCURRENT_EXTRACTIONS):
+        self.bot = bot
+        self.max_jobs = max_jobs
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.running: Dict[object, dict] = {}
+        self._job_tasks: Dict[object, asyncio.Task] = {}
+        self._runners = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """Start the claim loop on the running event loop"""
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def notify(self):
+        """Wake the claim loop, e.g. right after a local enqueue"""
+        self._wakeup.set()
+
+    def state(self) -> dict:
+        """Live worker state for /health"""
+        return {
+            "worker_id": self.worker_id,
+            "running_jobs": len(self.running),
+            "max_jobs": self.max_jobs
+        }
+
+    async def run(self):
+        """Claim loop"""
+        logger.info(f"✅ Job worker {self.worker_id} started")
+        while not self._stopping:
+            try:
+                while len(self.running) < self.max_jobs:
+                    job = await db.claim_job(self.worker_id, config.JOB_LEASE_SECONDS)
+                    if not job:
+                        break
+                    self.running[job['_id']] = job
+                    runner = asyncio.create_task(self._run_job(job))
+                    self._runners.add(runner)
+                    runner.add_done_callback(self._runners.discard)
+            except Exception as e:
+                logger.error(f"Job claim error: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job: dict):
+        """Run one claimed job with a heartbeat"""
+        job_id = job['_id']
+        user_id = job['user_id']
+        logger.info(f"Worker {self.worker_id} running job {job_id} (attempt {job.get('attempts', 1)})")
+
+        task = self._job_tasks[job_id] = asyncio.create_task(
+            extractor.extract_messages(
+                user_id,
+                job['chat_id'],
+                job['start_message_id'],
+                job['total_messages'],
+                make_progress_callback(self.bot, job.get('progress_chat_id'), job.get('progress_message_id')),
+                job.get('destination_chat_id'),
+                None,
+                job
+            )
+        )
+        try:
+            while not task.done():
+                done, _ = await asyncio.wait({task}, timeout=config.JOB_HEARTBEAT_SECONDS)
+                if done:
+                    break
+                alive = await db.renew_job_lease(
+                    job_id, self.worker_id, config.JOB_LEASE_SECONDS, job.get('next_offset')
+                )
+                if not alive:
+                    # Cancelled elsewhere or lease taken over, abort right away
+                    logger.info(f"Lost lease on job {job_id}, stopping")
+                    extractor.jobs.cancel(job_id)
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {e}")
+        finally:
+            self.running.pop(job_id, None)
+            self._job_tasks.pop(job_id, None)
+            self.notify()
+
+    async def stop(self):
+        """Stop claiming and hand running jobs back to the queue"""
+        self._stopping = True
+        self.notify()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+        job_ids = list(self._job_tasks)
+        tasks = list(self._job_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._runners, return_exceptions=True)
+        for job_id in job_ids:
+            try:
+                await db.release_job(job_id, self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to release job {job_id}: {e}")
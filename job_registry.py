@@ -0,0 +1,94 @@
+"""
+Job registry - In-process handles for running extractions and downloads
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+class ActiveJob:
+    """Handle for one running job with its own cancel token"""
+
+    __slots__ = ("job_id", "user_id", "kind", "task", "cancel_event", "started")
+
+    def __init__(self, job_id, user_id: int, kind: str, task: Optional[asyncio.Task] = None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.kind = kind
+        self.task = task
+        self.cancel_event = asyncio.Event()
+        self.started = time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Set the cancel token and abort whatever transfer the task is awaiting"""
+        if self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    def acknowledge_cancel(self):
+        """Clear the pending cancellation so cleanup code can still await"""
+        task = asyncio.current_task()
+        if task is self.task and hasattr(task, "uncancel"):
+            while task.cancelling():
+                task.uncancel()
+
+class JobRegistry:
+    """Running jobs by ID and by user; entries are removed as soon as a job ends"""
+
+    def __init__(self):
+        self._jobs: Dict[object, ActiveJob] = {}
+        self._by_user: Dict[int, Set[object]] = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def register(self, job_id, user_id: int, kind: str,
+                 task: Optional[asyncio.Task] = None) -> ActiveJob:
+        """Track a job; defaults to the task that is currently running"""
+        active = ActiveJob(job_id, user_id, kind, task or asyncio.current_task())
+        self._jobs[job_id] = active
+        self._by_user.setdefault(user_id, set()).add(job_id)
+        return active
+
+    def unregister(self, job_id):
+        active = self._jobs.pop(job_id, None)
+        if not active:
+            return
+        user_jobs = self._by_user.get(active.user_id)
+        if user_jobs is not None:
+            user_jobs.discard(job_id)
+            if not user_jobs:
+                del self._by_user[active.user_id]
+
+    def get(self, job_id) -> Optional[ActiveJob]:
+        return self._jobs.get(job_id)
+
+    def for_user(self, user_id: int) -> List[ActiveJob]:
+        return [self._jobs[job_id] for job_id in self._by_user.get(user_id, ())]
+
+    def cancel(self, job_id) -> bool:
+        active = self._jobs.get(job_id)
+        if not active:
+            return False
+        active.cancel()
+        return True
+
+    def cancel_user(self, user_id: int) -> int:
+        """Cancel every running job of a user, returns how many were cancelled"""
+        jobs = self.for_user(user_id)
+        for active in jobs:
+            active.cancel()
+        return len(jobs)
+
+    def state(self) -> dict:
+        """Live counts for /health"""
+        kinds: Dict[str, int] = {}
+        for active in self._jobs.values():
+            kinds[active.kind] = kinds.get(active.kind, 0) + 1
+        return {"running": len(self._jobs), "users": len(self._by_user), "by_kind": kinds}
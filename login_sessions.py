@@ -0,0 +1,94 @@
+"""
+Pending login sessions - Connected Pyrogram clients for /login conversations in progress
+Entries expire after LOGIN_TTL and a background reaper disconnects them
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+class PendingLogins:
+    """Dict-like store of in-progress logins with a TTL and a global cap"""
+
+    def __init__(self, ttl: int, max_pending: int):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._sessions: Dict[int, dict] = {}
+        self.reaped_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def __getitem__(self, user_id: int) -> dict:
+        return self._sessions[user_id]
+
+    def __setitem__(self, user_id: int, session: dict):
+        # Every step of the conversation refreshes the deadline
+        session['expires_at'] = time.monotonic() + self.ttl
+        self._sessions[user_id] = session
+
+    def __delitem__(self, user_id: int):
+        del self._sessions[user_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def is_full(self) -> bool:
+        return len(self._sessions) >= self.max_pending
+
+    async def discard(self, user_id: int):
+        """Remove a pending login and disconnect its client"""
+        session = self._sessions.pop(user_id, None)
+        if not session:
+            return
+        try:
+            await session['client'].disconnect()
+        except Exception:
+            pass
+
+    async def reap(self) -> int:
+        """Disconnect every expired login"""
+        now = time.monotonic()
+        expired = [uid for uid, session in self._sessions.items() if session['expires_at'] <= now]
+        for user_id in expired:
+            await self.discard(user_id)
+        if expired:
+            logger.info(f"Reaped {len(expired)} abandoned logins")
+        self.reaped_total += len(expired)
+        return len(expired)
+
+    def state(self) -> dict:
+        """Live counts for /health"""
+        return {
+            "pending": len(self._sessions),
+            "max_pending": self.max_pending,
+            "reaped_total": self.reaped_total
+        }
+
+    def start(self):
+        """Start the reaper on the running event loop"""
+        self._task = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(config.LOGIN_REAP_INTERVAL)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"Login reaper error: {e}")
+
+    async def stop(self):
+        """Stop the reaper and disconnect every pending login"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for user_id in list(self._sessions):
+            await self.discard(user_id)
+
+# Global pending login store
+user_sessions = PendingLogins(config.LOGIN_TTL, config.MAX_PENDING_LOGINS)
@@ -0,0 +1,174 @@
+"""
+Event loop monitor - Measures loop lag, catches blocking code and times every bot handler
+"""
+
+import asyncio
+import functools
+import io
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the lag histogram buckets, in milliseconds
+LAG_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class LoopMonitor:
+    """
+    A probe task sleeps for a fixed interval and records how late it wakes up
+    A watchdog thread notices when the probe stops beating and logs what the loop thread is running
+    """
+
+    def __init__(self, interval: float, stall_threshold: float):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.histogram: List[int] = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def record_lag(self, lag: float):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    async def _probe(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            self.record_lag(max(0.0, now - expected))
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            if time.monotonic() - beat < self.stall_threshold + self.interval or beat == reported_beat:
+                continue
+            # Still blocked: the loop thread's current frame is the culprit
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(
+                f"Event loop blocked for over {self.stall_threshold:.2f}s, loop thread stack:\n{stack}"
+            )
+
+    def start(self):
+        """Start the probe on the running loop and the watchdog thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._probe())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def state(self) -> dict:
+        """Lag histogram for /health"""
+        labels = [f"<={bound}ms" for bound in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "lag_histogram": dict(zip(labels, self.histogram)),
+            "handlers": handler_stats.state()
+        }
+
+class HandlerStats:
+    """Call count and timings per handler callback"""
+
+    def __init__(self):
+        # name -> [calls, total seconds, max seconds, slow calls]
+        self.stats: Dict[str, List[float]] = {}
+
+    def record(self, name: str, elapsed: float, slow: bool):
+        entry = self.stats.setdefault(name, [0, 0.0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        if slow:
+            entry[3] += 1
+
+    def state(self, limit: int = 10) -> dict:
+        slowest = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return {
+            name: {
+                "calls": int(calls),
+                "avg_ms": round(total / calls * 1000, 1) if calls else 0.0,
+                "max_ms": round(max_seconds * 1000, 1),
+                "slow": int(slow)
+            }
+            for name, (calls, total, max_seconds, slow) in slowest
+        }
+
+def _log_slow_task(task: asyncio.Task, name: str, threshold: float):
+    """Called while a handler is still running past the threshold, shows where it is waiting"""
+    buffer = io.StringIO()
+    task.print_stack(file=buffer)
+    logger.warning(f"Handler {name} still running after {threshold:.1f}s:\n{buffer.getvalue()}")
+
+def timed_callback(callback, name: str, threshold: float):
+    """Wrap a handler callback to record its runtime and log its stack when it is slow"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        task = asyncio.current_task()
+        timer = asyncio.get_running_loop().call_later(threshold, _log_slow_task, task, name, threshold)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            timer.cancel()
+            elapsed = time.perf_counter() - start
+            handler_stats.record(name, elapsed, elapsed >= threshold)
+    wrapper.__timed__ = True
+    return wrapper
+
+def _instrument(handler, threshold: float) -> int:
+    from telegram.ext import ConversationHandler
+    if isinstance(handler, ConversationHandler):
+        count = 0
+        inner = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            inner.extend(state_handlers)
+        for child in inner:
+            count += _instrument(child, threshold)
+        return count
+    callback = getattr(handler, "callback", None)
+    if callback is None or getattr(callback, "__timed__", False):
+        return 0
+    handler.callback = timed_callback(callback, getattr(callback, "__name__", repr(callback)), threshold)
+    return 1
+
+def instrument_handlers(application, threshold: float) -> int:
+    """Wrap every registered handler (including conversation states), returns how many"""
+    count = 0
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            count += _instrument(handler, threshold)
+    return count
+
+# Global monitor instances
+handler_stats = HandlerStats()
+loop_monitor = LoopMonitor(config.LOOP_LAG_INTERVAL, config.LOOP_STALL_THRESHOLD)
@@ -1,17 +1,37 @@
 """
-Main application file - Integrates bot with Flask for Render deployment
+Main application file - Runs the bot and its web server on one event loop for Render deployment
 """
 
+import time
+PROCESS_START = time.perf_counter()
+
 import asyncio
 import logging
-from threading import Thread
-from datetime import datetime
-from flask import Flask
+import aiofiles.os
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 import config
 from database import db
 from bot_handlers import *
 from admin_handlers import *
+from web_server import create_app, start_web_server, stop_web_server, register_health_provider
+from webhook import add_webhook_route, run_webhook
+from job_queue import JobWorker
+from premium_sweeper import PremiumSweeper
+from thumbnails import thumbnails
+from watermark import shutdown_executor
+from metrics import system_metrics
+from loop_monitor import loop_monitor, instrument_handlers
+from update_processor import PerUserUpdateProcessor
+from watch import watches
+from uploader import (
+    UPLOAD_BOT,
+    UPLOAD_METHODS,
+    UploadError,
+    choose_upload_method,
+    make_upload_progress,
+    upload_with_bot,
+    upload_with_client
+)
 
 # Configure logging
 logging.basicConfig(
@@ -20,101 +40,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Flask app for keeping bot alive on Render
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return """
-    <html>
-    <head>
-        <title>Extractor Bot - Running</title>
-        <style>
-            body {
-                margin: 0;
-                padding: 0;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                min-height: 100vh;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            }
-            .container {
-                text-align: center;
-                background: rgba(255, 255, 255, 0.1);
-                backdrop-filter: blur(10px);
-                border-radius: 20px;
-                padding: 50px;
-                box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-                border: 1px solid rgba(255, 255, 255, 0.2);
-            }
-            h1 {
-                color: white;
-                font-size: 3em;
-                margin: 0;
-                text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-            }
-            .status {
-                color: #4ade80;
-                font-size: 1.5em;
-                margin: 20px 0;
-                animation: pulse 2s infinite;
-            }
-            @keyframes pulse {
-                0%, 100% { opacity: 1; }
-                50% { opacity: 0.5; }
-            }
-            .info {
-                color: white;
-                font-size: 1.1em;
-                margin: 15px 0;
-            }
-            .badge {
-                display: inline-block;
-                background: rgba(255, 255, 255, 0.2);
-                padding: 10px 20px;
-                border-radius: 25px;
-                margin: 10px 5px;
-                color: white;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🚀 Extractor Bot</h1>
-            <div class="status">🟢 Bot is Running</div>
-            <div class="info">Advanced Telegram Content Extraction Bot</div>
-            <div class="info">
-                <span class="badge">⚡ Fast Extraction</span>
-                <span class="badge">🔒 Secure</span>
-                <span class="badge">💎 Premium Features</span>
-            </div>
-            <div class="info" style="margin-top: 30px; font-size: 0.9em; opacity: 0.8;">
-                Powered by RATNA ❤️
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-
-@app.route('/health')
-def health():
-    """Health check endpoint for monitoring"""
-    return {
-        "status": "healthy",
-        "bot": "running",
-        "timestamp": datetime.now().isoformat()
-    }
-
-@app.route('/ping')
-def ping():
-    """Simple ping endpoint for UptimeRobot"""
-    return "pong"
-
-def run_flask():
-    """Run Flask app in a separate thread"""
-    app.run(host='0.0.0.0', port=config.PORT, debug=False, use_reloader=False)
+IMPORT_SECONDS = time.perf_counter() - PROCESS_START
+startup_timings = {"imports_seconds": round(IMPORT_SECONDS, 3)}
 
 # ===== CALLBACK QUERY HANDLERS =====
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -135,6 +62,12 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "buypremium":
         await buy_premium_command(update, context)
     
+    elif data.startswith("upload_"):
+        method = data.replace("upload_", "")
+        if method in UPLOAD_METHODS:
+            await db.update_settings(update.effective_user.id, upload_method=method)
+            await query.message.reply_text(f"✅ Upload method set to **{method}**", parse_mode=ParseMode.MARKDOWN)
+    
     # Settings callbacks
     elif data.startswith("setting_"):
         setting = data.replace("setting_", "")
@@ -146,8 +79,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         elif setting == "logout":
             user_id = update.effective_user.id
-            await db.delete_session(user_id)
-            await extractor.cleanup_user_client(user_id)
+            await logout_user(user_id)
             await query.message.reply_text("✅ Logged out successfully!")
         
         elif setting == "chatid":
@@ -186,6 +118,69 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode=ParseMode.MARKDOWN
             )
         
+        elif setting == "thumb":
+            context.user_data['awaiting_image'] = 'thumbnail'
+            await query.message.reply_text(
+                "🖼️ **Set Thumbnail**\n\n"
+                "Send the photo you want to use as thumbnail.\n"
+                "It will be resized to 320px automatically.\n\n"
+                "Send /cancel to abort.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        
+        elif setting == "removethumb":
+            user_id = update.effective_user.id
+            await db.update_settings(user_id, thumbnail=None)
+            await query.message.reply_text("✅ Thumbnail removed!")
+        
+        elif setting == "watermark":
+            context.user_data['awaiting_image'] = 'watermark'
+            await query.message.reply_text(
+                "💧 **Set Photo Watermark**\n\n"
+                "Send the logo you want on your photos.\n"
+                "Send a PNG as a file to keep its transparency.\n"
+                "It is placed in the bottom-right corner.\n\n"
+                "Send /cancel to abort.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        
+        elif setting == "removewatermark":
+            user_id = update.effective_user.id
+            await db.update_settings(user_id, watermark=None)
+            await query.message.reply_text("✅ Watermark removed!")
+        
+        elif setting == "upload":
+            settings = await db.get_settings(update.effective_user.id)
+            current = settings.get('upload_method') or "auto"
+            keyboard = [[
+                InlineKeyboardButton("🤖 Auto", callback_data="upload_auto"),
+                InlineKeyboardButton("📨 Bot API", callback_data="upload_bot"),
+                InlineKeyboardButton("👤 My Account", callback_data="upload_user")
+            ]]
+            await query.message.reply_text(
+                "📤 **Upload Method**\n\n"
+                "• **Auto** - Bot API up to 50 MB, your account for bigger files\n"
+                "• **Bot API** - Always through the bot (max 50 MB)\n"
+                "• **My Account** - Always through your logged in account (max 2 GB, faster)\n\n"
+                f"Current: **{current}**",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode=ParseMode.MARKDOWN
+            )
+        
+        elif setting == "dedupe":
+            user_id = update.effective_user.id
+            settings = await db.get_settings(user_id)
+            enabled = not settings.get('dedupe', False)
+            await db.update_settings(user_id, dedupe=enabled)
+            if enabled:
+                await query.message.reply_text(
+                    "♻️ **Skip Duplicates: ON**\n\n"
+                    "Files and text posts repeated within a batch are sent only once.",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            else:
+                await query.message.reply_text("♻️ **Skip Duplicates: OFF**", parse_mode=ParseMode.MARKDOWN)
+        
         elif setting == "report":
             await query.message.reply_text(
                 "⚠️ **Report an Error**\n\n"
@@ -221,6 +216,41 @@ To generate session, use /login command.
     await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
 
 # ===== DOWNLOAD COMMANDS =====
+async def upload_downloaded_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_path: str,
+                                 meta: dict, kind: str, progress_callback):
+    """Send a /dl or /adl file back through the Bot API or the user's account"""
+    user_id = update.effective_user.id
+    try:
+        settings = await db.get_settings(user_id)
+        thumb_path = await thumbnails.get_path(settings.get('thumbnail'))
+        file_size = (await aiofiles.os.stat(file_path)).st_size
+        client = await extractor.get_user_client(user_id)
+        method = choose_upload_method(file_size, settings.get('upload_method'), client is not None)
+        
+        if method == UPLOAD_BOT:
+            await progress_callback("⬆️ Uploading...")
+            await upload_with_bot(context.bot, update.effective_chat.id, file_path, kind, None, thumb_path, meta)
+            await progress_callback("✅ Upload complete!")
+        else:
+            # The user's account can send up to 2 GB, files land in the upload chat or Saved Messages
+            destination = settings.get('chat_id') or "me"
+            await upload_with_client(
+                client, destination, file_path, kind, None, thumb_path, meta,
+                progress=make_upload_progress(progress_callback)
+            )
+            where = f"`{destination}`" if destination != "me" else "your Saved Messages"
+            await progress_callback(f"✅ Uploaded through your account to {where}")
+    except UploadError as e:
+        await update.message.reply_text(f"❌ {str(e)}")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Upload failed: {str(e)}")
+    finally:
+        try:
+            await aiofiles.os.remove(file_path)
+        except OSError:
+            pass
+
+
 async def download_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download video from message link"""
     if not context.args:
@@ -243,16 +273,11 @@ async def download_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
     
-    file_path = await extractor.download_media(user_id, link, progress_callback, 'video')
+    result = await extractor.download_media(user_id, link, progress_callback, 'video')
     
-    if file_path:
-        await update.message.reply_text("✅ Download complete! Uploading...")
-        try:
-            await update.message.reply_video(video=open(file_path, 'rb'))
-            import os
-            os.remove(file_path)
-        except Exception as e:
-            await update.message.reply_text(f"❌ Upload failed: {str(e)}")
+    if result:
+        file_path, meta = result
+        await upload_downloaded_file(update, context, file_path, meta, 'video', progress_callback)
 
 async def download_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Download audio from message link"""
@@ -276,35 +301,110 @@ async def download_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
     
-    file_path = await extractor.download_media(user_id, link, progress_callback, 'audio')
+    result = await extractor.download_media(user_id, link, progress_callback, 'audio')
     
-    if file_path:
-        await update.message.reply_text("✅ Download complete! Uploading...")
-        try:
-            await update.message.reply_audio(audio=open(file_path, 'rb'))
-            import os
-            os.remove(file_path)
-        except Exception as e:
-            await update.message.reply_text(f"❌ Upload failed: {str(e)}")
+    if result:
+        file_path, meta = result
+        await upload_downloaded_file(update, context, file_path, meta, 'audio', progress_callback)
 
-def main():
-    """Main function to run the bot"""
-    logger.info("🚀 Starting Extractor Bot...")
+# ===== WEB SERVER LIFECYCLE =====
+def extraction_state() -> dict:
+    """Live extraction state for /health"""
+    return {
+        "jobs": extractor.jobs.state(),
+        "user_clients": len(extractor.user_clients),
+        "pending_logins": user_sessions.state()
+    }
+
+async def post_init(application: Application):
+    """Initialize the database and start the web server on the bot's event loop"""
+    # Mongo client is created here, on the running loop; indexes can build in the background
+    await db.init_db(background=config.FAST_STARTUP)
+    logger.info("✅ Database initialized")
     
-    # Start Flask in background thread
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info(f"✅ Flask server started on port {config.PORT}")
+    register_health_provider("startup", lambda: startup_timings)
+    register_health_provider("extraction", extraction_state)
+    register_health_provider("updates", lambda: {
+        "mode": "webhook" if config.WEBHOOK_URL else "polling",
+        "queued": application.update_queue.qsize(),
+        **application.update_processor.state()
+    })
     
-    # Create bot application
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    # Claim queued extraction jobs in this process too
+    if config.JOB_WORKER_ENABLED:
+        worker = JobWorker(application.bot)
+        application.bot_data['job_worker'] = worker
+        register_health_provider("job_worker", worker.state)
+        worker.start()
     
-    # Initialize database
-    async def init():
-        await db.init_db()
-        logger.info("✅ Database initialized")
+    # Mirror new posts of watched chats; watches are leased, so each runs in one process
+    # and catches up from its last mirrored ID when it is claimed
+    if config.WATCH_ENABLED:
+        register_health_provider("watches", watches.state)
+        watches.start(application.bot)
     
-    asyncio.get_event_loop().run_until_complete(init())
+    # Loop lag histogram and blocked-loop stacks
+    register_health_provider("event_loop", loop_monitor.state)
+    loop_monitor.start()
+    
+    # CPU/RAM/disk/network snapshots for /stats, /speedtest and /health
+    register_health_provider("system", system_metrics.state)
+    system_metrics.start()
+    
+    # Disconnect abandoned /login clients
+    user_sessions.start()
+    
+    # Expire premium in the background so check_premium stays a pure read
+    sweeper = PremiumSweeper(application.bot)
+    application.bot_data['premium_sweeper'] = sweeper
+    register_health_provider("premium_sweeper", sweeper.state)
+    sweeper.start()
+    
+    app = create_app()
+    if config.WEBHOOK_URL:
+        add_webhook_route(app, application)
+    application.bot_data['web_runner'] = await start_web_server(app, config.PORT)
+    
+    startup_timings["cold_start_seconds"] = round(time.perf_counter() - PROCESS_START, 3)
+    logger.info(
+        f"⏱️ Cold start: {startup_timings['cold_start_seconds']:.2f}s "
+        f"(imports {startup_timings['imports_seconds']:.2f}s)"
+    )
+
+async def post_shutdown(application: Application):
+    """Stop background tasks and the web server"""
+    # Watches stay active in the database and catch up after the restart
+    await watches.shutdown()
+    worker = application.bot_data.get('job_worker')
+    if worker:
+        await worker.stop()
+    sweeper = application.bot_data.get('premium_sweeper')
+    if sweeper:
+        await sweeper.stop()
+    broadcast = application.bot_data.get('broadcast')
+    if broadcast:
+        # Resumable with /broadcast resume after the restart
+        await broadcast.stop("interrupted")
+    await user_sessions.stop()
+    await system_metrics.stop()
+    await loop_monitor.stop()
+    shutdown_executor()
+    await stop_web_server(application.bot_data.get('web_runner'))
+
+def main():
+    """Main function to run the bot"""
+    logger.info("🚀 Starting Extractor Bot...")
+    
+    # Create bot application; users are served in parallel, each user's updates in order
+    update_processor = PerUserUpdateProcessor(config.MAX_CONCURRENT_UPDATES)
+    application = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Login conversation handler
     login_conv = ConversationHandler(
@@ -335,6 +435,10 @@ def main():
     application.add_handler(CommandHandler("logout", logout))
     application.add_handler(CommandHandler("session", session_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("retry", retry_command))
+    application.add_handler(CommandHandler("trace", trace_command))
+    application.add_handler(CommandHandler("watch", watch_command))
+    application.add_handler(CommandHandler("unwatch", unwatch_command))
     
     # Download handlers
     application.add_handler(CommandHandler("dl", download_video))
@@ -345,6 +449,8 @@ def main():
     application.add_handler(CommandHandler("rem", remove_premium_command))
     application.add_handler(CommandHandler("get", get_users_command))
     application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("indexes", indexes_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
     
     # Premium handlers
     application.add_handler(CommandHandler("transfer", transfer_premium))
@@ -358,16 +464,30 @@ def main():
     application.add_handler(CommandHandler("speedtest", speedtest_command))
     application.add_handler(CommandHandler("terms", terms_command))
     
+    # Custom thumbnail and watermark upload
+    application.add_handler(MessageHandler(
+        (filters.PHOTO | filters.Document.IMAGE) & filters.ChatType.PRIVATE,
+        image_setting_handler
+    ))
+    
     # Callback query handler
     application.add_handler(CallbackQueryHandler(button_callback))
     
+    # Time every handler, slow ones are logged with their stack
+    timed = instrument_handlers(application, config.SLOW_HANDLER_SECONDS)
+    logger.info(f"⏱️ Timing {timed} handlers")
+    
     # Start bot
     logger.info("✅ Bot started successfully!")
     logger.info("🌐 Keep-alive URL for UptimeRobot: https://your-app.onrender.com/ping")
     logger.info("📊 Health check: https://your-app.onrender.com/health")
     
     # Run the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.WEBHOOK_URL:
+        logger.info("🔗 Running in webhook mode")
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,118 @@
+"""
+System metrics - Samples CPU, RAM, disk, network and process stats in the background
+Commands read the latest snapshot instead of blocking the event loop on psutil
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, List, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+class MetricsSampler:
+    """Ring buffer of system snapshots filled by a background task"""
+
+    def __init__(self, interval: float, history: int):
+        self.interval = interval
+        self.samples: Deque[dict] = deque(maxlen=history)
+        self._process = None
+        self._last_net = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _sample(self) -> dict:
+        """Collect one snapshot (runs in a thread, psutil calls can touch the disk)"""
+        import psutil
+        if self._process is None:
+            self._process = psutil.Process()
+            # First non-blocking cpu_percent calls only set the baseline
+            psutil.cpu_percent(interval=None)
+            self._process.cpu_percent(interval=None)
+
+        now = time.time()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net = psutil.net_io_counters()
+        sent_rate = recv_rate = 0.0
+        if self._last_net:
+            last_time, last_sent, last_recv = self._last_net
+            elapsed = now - last_time
+            if elapsed > 0:
+                sent_rate = (net.bytes_sent - last_sent) / elapsed
+                recv_rate = (net.bytes_recv - last_recv) / elapsed
+        self._last_net = (now, net.bytes_sent, net.bytes_recv)
+
+        with self._process.oneshot():
+            process = {
+                "cpu_percent": self._process.cpu_percent(interval=None),
+                "rss": self._process.memory_info().rss,
+                "threads": self._process.num_threads(),
+                "uptime": now - self._process.create_time()
+            }
+
+        return {
+            "time": now,
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "ram_percent": memory.percent,
+            "ram_available": memory.available,
+            "disk_percent": disk.percent,
+            "net_sent_rate": sent_rate,
+            "net_recv_rate": recv_rate,
+            "process": process
+        }
+
+    async def sample_now(self) -> dict:
+        snapshot = await asyncio.to_thread(self._sample)
+        self.samples.append(snapshot)
+        return snapshot
+
+    async def latest(self) -> dict:
+        """Most recent snapshot, sampled on demand only before the first tick"""
+        if self.samples:
+            return self.samples[-1]
+        return await self.sample_now()
+
+    def history(self, seconds: float) -> List[dict]:
+        cutoff = time.time() - seconds
+        return [s for s in self.samples if s["time"] >= cutoff]
+
+    def average(self, key: str, seconds: float = 60) -> Optional[float]:
+        values = [s[key] for s in self.history(seconds)]
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def state(self) -> dict:
+        """Latest snapshot for /health"""
+        if not self.samples:
+            return {"samples": 0}
+        latest = self.samples[-1]
+        return {
+            "samples": len(self.samples),
+            "cpu_percent": latest["cpu_percent"],
+            "ram_percent": latest["ram_percent"],
+            "disk_percent": latest["disk_percent"],
+            "process_rss": latest["process"]["rss"]
+        }
+
+    def start(self):
+        """Start sampling on the running event loop"""
+        self._task = asyncio.create_task(self._sample_loop())
+
+    async def _sample_loop(self):
+        while True:
+            try:
+                await self.sample_now()
+            except Exception as e:
+                logger.error(f"Metrics sample error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+# Global metrics sampler
+system_metrics = MetricsSampler(config.METRICS_INTERVAL, config.METRICS_HISTORY)
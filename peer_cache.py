@@ -0,0 +1,143 @@
+"""
+Peer cache - Persists resolved peers per user client and remembers chats a user can't access
+"""
+
+import time
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple, TYPE_CHECKING
+import config
+from database import db
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+
+# Reason code -> message shown to the user
+ACCESS_ERRORS = {
+    "private": "❌ This is a private channel. Please login first using /login",
+    "not_participant": "❌ You are not a member of this channel/group",
+    "invalid": "❌ This channel/group doesn't exist or the link is wrong"
+}
+
+def chat_key(chat_id) -> str:
+    """Normalize a chat ID or username the way Pyrogram looks them up"""
+    if isinstance(chat_id, int):
+        return str(chat_id)
+    return chat_id.lower().lstrip('@')
+
+def _peer_row(input_peer, chat_id) -> Optional[Tuple[int, int, str, Optional[str], None]]:
+    """Convert a resolved InputPeer into a Pyrogram storage row"""
+    from pyrogram import utils
+    from pyrogram.raw.types import InputPeerUser, InputPeerChat, InputPeerChannel
+    username = chat_key(chat_id) if isinstance(chat_id, str) else None
+    if isinstance(input_peer, InputPeerChannel):
+        return (utils.get_channel_id(input_peer.channel_id), input_peer.access_hash, "channel", username, None)
+    if isinstance(input_peer, InputPeerUser):
+        return (input_peer.user_id, input_peer.access_hash, "user", username, None)
+    if isinstance(input_peer, InputPeerChat):
+        return (-input_peer.chat_id, 0, "group", None, None)
+    return None
+
+class PeerCache:
+    """Resolve-once peer storage and negative access cache"""
+
+    def __init__(self):
+        # (user_id, chat key) -> (reason, monotonic expiry)
+        self._denied: Dict[Tuple[int, str], Tuple[str, float]] = {}
+        # Chats already written to Mongo for each user
+        self._known: Dict[int, Set[str]] = {}
+
+    async def restore(self, user_id: int, client: "Client") -> int:
+        """Load saved peers into a freshly started client's storage"""
+        peers = await db.get_peers(user_id)
+        rows = [
+            (p['peer_id'], p['access_hash'], p['peer_type'], p.get('username'), None)
+            for p in peers
+        ]
+        if rows:
+            await client.storage.update_peers(rows)
+        self._known[user_id] = {p['chat_key'] for p in peers}
+        return len(rows)
+
+    async def get_denied(self, user_id: int, chat_id) -> Optional[str]:
+        """Reason code if this user recently failed to access the chat"""
+        key = (user_id, chat_key(chat_id))
+        cached = self._denied.get(key)
+        if cached:
+            reason, expires = cached
+            if expires > time.monotonic():
+                return reason
+            del self._denied[key]
+
+        failure = await db.get_access_failure(user_id, key[1])
+        if failure:
+            remaining = (failure['expires_at'] - datetime.utcnow()).total_seconds()
+            self._denied[key] = (failure['reason'], time.monotonic() + remaining)
+            return failure['reason']
+        return None
+
+    async def deny(self, user_id: int, chat_id, reason: str):
+        """Remember that the user can't access a chat"""
+        key = chat_key(chat_id)
+        ttl = config.ACCESS_FAILURE_TTL
+        self._denied[(user_id, key)] = (reason, time.monotonic() + ttl)
+        await db.save_access_failure(user_id, key, reason, ttl)
+
+    async def allow(self, user_id: int, chat_id):
+        """Drop a remembered failure, e.g. the user joined the chat meanwhile"""
+        key = chat_key(chat_id)
+        self._denied.pop((user_id, key), None)
+        await db.delete_access_failure(user_id, key)
+
+    async def check_access(self, user_id: int, client: "Client", chat_id, recheck: bool = False) -> Optional[str]:
+        """
+        Resolve the chat before the first fetch
+        Returns an error message when the job is bound to fail, None otherwise
+        recheck resolves again despite a remembered failure, for links the user just sent
+        """
+        from pyrogram.errors import (
+            ChannelInvalid, ChannelPrivate, PeerIdInvalid,
+            UsernameInvalid, UsernameNotOccupied, UserNotParticipant
+        )
+        denied = await self.get_denied(user_id, chat_id)
+        if denied and not recheck:
+            return ACCESS_ERRORS.get(denied, ACCESS_ERRORS["invalid"])
+
+        try:
+            input_peer = await client.resolve_peer(chat_id)
+        except ChannelPrivate:
+            reason = "private"
+        except UserNotParticipant:
+            reason = "not_participant"
+        except (ChannelInvalid, PeerIdInvalid, UsernameInvalid, UsernameNotOccupied, KeyError, ValueError):
+            reason = "private" if isinstance(chat_id, int) else "invalid"
+        else:
+            if denied:
+                await self.allow(user_id, chat_id)
+            await self.remember(user_id, chat_id, input_peer)
+            return None
+
+        await self.deny(user_id, chat_id, reason)
+        return ACCESS_ERRORS[reason]
+
+    async def remember(self, user_id: int, chat_id, input_peer):
+        """Persist a resolved peer so the next client start skips the resolve call"""
+        key = chat_key(chat_id)
+        known = self._known.setdefault(user_id, set())
+        if key in known:
+            return
+        row = _peer_row(input_peer, chat_id)
+        if not row:
+            return
+        peer_id, access_hash, peer_type, username, _ = row
+        await db.save_peer(user_id, key, peer_id, access_hash, peer_type, username)
+        known.add(key)
+
+    async def forget_user(self, user_id: int):
+        """Drop everything cached for a user (new login or logout)"""
+        self._known.pop(user_id, None)
+        for key in [k for k in self._denied if k[0] == user_id]:
+            del self._denied[key]
+        await db.delete_user_peers(user_id)
+
+# Global peer cache instance
+peer_cache = PeerCache()
@@ -0,0 +1,86 @@
+"""
+Premium sweeper - Expires premium users in the background and notifies them
+"""
+
+import asyncio
+import logging
+from typing import List
+from telegram.constants import ParseMode
+from telegram.error import Forbidden, RetryAfter
+import config
+from database import db
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_MESSAGE = """⚠️ **Premium Expired**
+
+Your premium subscription has ended.
+Renew anytime: /plan"""
+
+class PremiumSweeper:
+    """Periodically clears expired premium in batches and queues expiry notices"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.notifications: asyncio.Queue = asyncio.Queue()
+        self.limiter = RateLimiter(config.PREMIUM_NOTIFY_RATE)
+        self.expired_total = 0
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        """Start sweep and notification loops on the running event loop"""
+        self._tasks = [
+            asyncio.create_task(self._sweep_loop()),
+            asyncio.create_task(self._notify_loop())
+        ]
+
+    def state(self) -> dict:
+        """Live sweeper state for /health"""
+        return {
+            "expired_total": self.expired_total,
+            "pending_notifications": self.notifications.qsize()
+        }
+
+    async def sweep_once(self) -> int:
+        """Expire every overdue user, one batch at a time"""
+        total = 0
+        while True:
+            user_ids = await db.expire_premium_batch(config.PREMIUM_SWEEP_BATCH)
+            for user_id in user_ids:
+                self.notifications.put_nowait(user_id)
+            total += len(user_ids)
+            if len(user_ids) < config.PREMIUM_SWEEP_BATCH:
+                break
+        if total:
+            logger.info(f"Expired premium for {total} users")
+        self.expired_total += total
+        return total
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep_once()
+            except Exception as e:
+                logger.error(f"Premium sweep error: {e}")
+            await asyncio.sleep(config.PREMIUM_SWEEP_INTERVAL)
+
+    async def _notify_loop(self):
+        while True:
+            user_id = await self.notifications.get()
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(user_id, EXPIRY_MESSAGE, parse_mode=ParseMode.MARKDOWN)
+            except RetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                self.notifications.put_nowait(user_id)
+            except Forbidden:
+                # User blocked the bot
+                pass
+            except Exception as e:
+                logger.error(f"Expiry notification to {user_id} failed: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
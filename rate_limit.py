@@ -0,0 +1,36 @@
+"""
+Rate limiting - Token bucket shared by concurrent Bot API senders
+"""
+
+import asyncio
+import time
+
+class RateLimiter:
+    """Allows `rate` acquisitions per second on average, with short bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a send is allowed"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold every sender back, e.g. after a flood/RetryAfter error"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
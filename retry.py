@@ -0,0 +1,110 @@
+"""
+Retry handling for extraction - Error classification, backoff queue and per-source circuit breaker
+"""
+
+import asyncio
+import heapq
+import random
+import time
+from typing import List, Optional, Tuple
+
+# Error classes
+TRANSIENT = "transient"    # worth retrying later (network, 5xx, FloodWait)
+PERMANENT = "permanent"    # this message will never work (deleted, invalid media...)
+ACCESS = "access"          # the job can't continue (lost access to source or destination)
+
+def classify_error(error: BaseException) -> str:
+    """Sort an exception raised while processing a message into an error class"""
+    from pyrogram.errors import (
+        BadRequest, Flood, Forbidden, InternalServerError, ServiceUnavailable, Unauthorized,
+        ChannelInvalid, ChannelPrivate, ChatAdminRequired, PeerIdInvalid, UserNotParticipant
+    )
+    if isinstance(error, (ChannelPrivate, UserNotParticipant, ChannelInvalid, ChatAdminRequired,
+                          PeerIdInvalid, Forbidden, Unauthorized)):
+        return ACCESS
+    if isinstance(error, (Flood, InternalServerError, ServiceUnavailable)):
+        return TRANSIENT
+    if isinstance(error, BadRequest):
+        return PERMANENT
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError)):
+        return TRANSIENT
+    # Unknown errors get a few retries before they are reported as failed
+    return TRANSIENT
+
+class RetryQueue:
+    """Message IDs waiting for another attempt, ordered by when they become ready"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # (ready_at, index, attempts)
+        self._heap: List[Tuple[float, int, int]] = []
+        self.retried = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, index: int, attempts: int, delay: Optional[float] = None) -> bool:
+        """Schedule attempt number `attempts`, False when that would exceed max_attempts"""
+        if attempts > self.max_attempts:
+            return False
+        if delay is None:
+            # Exponential backoff with jitter
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+        heapq.heappush(self._heap, (time.monotonic() + delay, index, attempts))
+        self.retried += 1
+        return True
+
+    def pop_ready(self) -> List[Tuple[int, int]]:
+        """All (index, attempts) whose backoff has passed"""
+        now = time.monotonic()
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            _, index, attempts = heapq.heappop(self._heap)
+            ready.append((index, attempts))
+        return ready
+
+    def lowest_index(self) -> Optional[int]:
+        """Smallest index still waiting for another attempt"""
+        if not self._heap:
+            return None
+        return min(index for _, index, _ in self._heap)
+
+    def next_delay(self) -> float:
+        """Seconds until the next retry is ready"""
+        if not self._heap:
+            return 0.0
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+class CircuitBreaker:
+    """Stops hammering a source after repeated transient failures"""
+
+    __slots__ = ("threshold", "cooldown", "failures", "opened_at")
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def wait_time(self) -> float:
+        """Seconds until a trial request is allowed again"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            # Open (or re-open after a failed trial) for another cooldown
+            self.opened_at = time.monotonic()
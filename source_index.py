@@ -0,0 +1,128 @@
+"""
+Source message index - Metadata of source chat messages kept in MongoDB
+Filled by extractions and prefetches, so repeat jobs and dry runs only ask Telegram for what's new
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+from database import db
+from peer_cache import chat_key
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+    from pyrogram.types import Message
+
+FETCH_CHUNK = 200  # get_messages accepts up to 200 IDs per call
+LOOKUP_CHUNK = 1000
+FLUSH_SIZE = 100
+
+# Type of IDs that exist in the chat's ID space but have no message (deleted)
+MISSING = "missing"
+
+def describe(message_id: int, message: Optional["Message"], user_id: int) -> dict:
+    """Metadata kept for one message, seen through the given user's session"""
+    if not message or message.empty:
+        # Hidden history and join dates make a message empty for one member only
+        return {"message_id": message_id, "type": MISSING, "seen_by": user_id}
+    entry = {
+        "message_id": message_id,
+        "type": "text",
+        "size": 0,
+        "file_unique_id": None,
+        "date": message.date,
+        "media_group_id": message.media_group_id
+    }
+    if message.service:
+        entry["type"] = "service"
+    elif message.media:
+        entry["type"] = message.media.value
+        media = getattr(message, entry["type"], None)
+        entry["size"] = getattr(media, 'file_size', 0) or 0
+        entry["file_unique_id"] = getattr(media, 'file_unique_id', None)
+    return entry
+
+async def record(chat_id, entries: List[dict]):
+    """Store described messages of a source chat"""
+    await db.save_message_index(chat_key(chat_id), entries)
+
+async def high_water(chat_id) -> int:
+    """Newest message ID known to exist in the source chat"""
+    state = await db.get_source_index_state(chat_key(chat_id))
+    return (state or {}).get("high_water", 0)
+
+def _trusted(entry: dict, newest: int, user_id: int) -> bool:
+    if entry["type"] != MISSING:
+        return True
+    # An empty ID above the newest known message may just not be posted yet,
+    # and one member may see nothing where another sees a message
+    return entry["message_id"] <= newest and entry.get("seen_by") == user_id
+
+async def lookup(chat_id, message_ids: List[int], user_id: int) -> Dict[int, dict]:
+    """Indexed metadata by message ID for one user, IDs that aren't indexed are left out"""
+    source = chat_key(chat_id)
+    newest = await high_water(chat_id)
+    found: Dict[int, dict] = {}
+    for offset in range(0, len(message_ids), LOOKUP_CHUNK):
+        for entry in await db.get_message_index(source, message_ids[offset:offset + LOOKUP_CHUNK]):
+            if _trusted(entry, newest, user_id):
+                found[entry["message_id"]] = entry
+    return found
+
+async def known_missing(chat_id, message_ids: List[int], user_id: int) -> Set[int]:
+    """IDs this user already saw deleted, their jobs skip them without calling Telegram"""
+    source = chat_key(chat_id)
+    newest = await high_water(chat_id)
+    missing: Set[int] = set()
+    for offset in range(0, len(message_ids), LOOKUP_CHUNK):
+        entries = await db.get_message_index(
+            source, message_ids[offset:offset + LOOKUP_CHUNK],
+            {"_id": 0, "message_id": 1, "type": 1, "seen_by": 1}
+        )
+        missing.update(
+            e["message_id"] for e in entries
+            if e["type"] == MISSING and _trusted(e, newest, user_id)
+        )
+    return missing
+
+async def get_metadata(client: "Client", chat_id, message_ids: List[int],
+                       user_id: int) -> Tuple[Dict[int, dict], int]:
+    """
+    Metadata for every ID, from the index where possible, and how many IDs had to be fetched
+    Only IDs that aren't indexed yet, or that only another user saw deleted, are fetched and then indexed
+    """
+    from pyrogram.errors import FloodWait
+    metadata = await lookup(chat_id, message_ids, user_id)
+    unknown = [message_id for message_id in message_ids if message_id not in metadata]
+    for offset in range(0, len(unknown), FETCH_CHUNK):
+        chunk = unknown[offset:offset + FETCH_CHUNK]
+        while True:
+            try:
+                messages = await client.get_messages(chat_id, chunk)
+                break
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+        entries = [describe(message_id, message, user_id) for message_id, message in zip(chunk, messages)]
+        await record(chat_id, entries)
+        for entry in entries:
+            metadata[entry["message_id"]] = entry
+    return metadata, len(unknown)
+
+class IndexBuffer:
+    """Collects metadata of messages a job fetched anyway, written in batches"""
+
+    def __init__(self, chat_id, user_id: int):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.entries: List[dict] = []
+
+    def add(self, message_id: int, message: Optional["Message"]):
+        self.entries.append(describe(message_id, message, self.user_id))
+
+    @property
+    def full(self) -> bool:
+        return len(self.entries) >= FLUSH_SIZE
+
+    async def flush(self):
+        entries, self.entries = self.entries, []
+        if entries:
+            await record(self.chat_id, entries)
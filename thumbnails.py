@@ -0,0 +1,100 @@
+"""
+Thumbnail pipeline - Processes the user's custom thumbnail (and watermark) once and caches it by content hash
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+from typing import Dict, Optional
+import config
+from database import db
+from watermark import prepare_watermark
+
+THUMB_DIR = os.path.join(config.TEMP_DIR, "thumbnails")
+THUMB_MAX_SIDE = 320  # Telegram's limit for thumbnail width/height
+THUMB_MAX_BYTES = 200 * 1024  # Telegram's limit for thumbnail JPEG size
+WATERMARK_DIR = os.path.join(config.TEMP_DIR, "watermarks")
+
+def process_thumbnail(data: bytes) -> bytes:
+    """Resize an image into a Telegram-compatible JPEG thumbnail (CPU bound, run in a thread)"""
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE))
+        for quality in (90, 80, 70, 60, 50):
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= THUMB_MAX_BYTES:
+                break
+    return buffer.getvalue()
+
+def _write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+class ThumbnailStore:
+    """Content-addressed thumbnails, kept in Mongo and cached as local files"""
+
+    directory = THUMB_DIR
+    extension = "jpg"
+    process = staticmethod(process_thumbnail)
+
+    def __init__(self):
+        # digest -> local file path
+        self._paths: Dict[str, str] = {}
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.{self.extension}")
+
+    async def _store(self, digest: str, data: bytes):
+        await db.save_thumbnail(digest, data)
+
+    async def _load(self, digest: str):
+        return await db.get_thumbnail(digest)
+
+    async def save(self, data: bytes) -> str:
+        """Process an uploaded image once and return its content hash"""
+        processed = await asyncio.to_thread(self.process, data)
+        digest = hashlib.sha256(processed).hexdigest()
+        if digest not in self._paths:
+            await self._store(digest, processed)
+            path = self.path_for(digest)
+            await asyncio.to_thread(_write_file, path, processed)
+            self._paths[digest] = path
+        return digest
+
+    async def get_path(self, digest: Optional[str]) -> Optional[str]:
+        """Local file for a thumbnail, restored from Mongo if this instance doesn't have it"""
+        if not digest:
+            return None
+        path = self._paths.get(digest)
+        if path and os.path.exists(path):
+            return path
+
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            doc = await self._load(digest)
+            if not doc:
+                return None
+            await asyncio.to_thread(_write_file, path, bytes(doc['data']))
+        self._paths[digest] = path
+        return path
+
+class WatermarkStore(ThumbnailStore):
+    """Same storage for watermark assets, kept as RGBA PNG"""
+
+    directory = WATERMARK_DIR
+    extension = "png"
+    process = staticmethod(prepare_watermark)
+
+    async def _store(self, digest: str, data: bytes):
+        await db.save_watermark(digest, data)
+
+    async def _load(self, digest: str):
+        return await db.get_watermark(digest)
+
+# Global thumbnail and watermark stores
+thumbnails = ThumbnailStore()
+watermarks = WatermarkStore()
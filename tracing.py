@@ -0,0 +1,143 @@
+"""
+Lightweight per-job tracing for the extraction hot path
+Records how long each stage (fetch, copy, db writes, progress edits, FloodWait sleeps) takes
+"""
+
+import heapq
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Stage names used across the extractor
+STAGE_GET_MESSAGES = "get_messages"
+STAGE_COPY = "copy"
+STAGE_FORWARD = "forward"
+STAGE_DOWNLOAD = "download"
+STAGE_UPLOAD = "upload"
+STAGE_WATERMARK = "watermark"
+STAGE_DB_WRITE = "db_write"
+STAGE_PROGRESS = "progress_edit"
+STAGE_FLOOD_WAIT = "flood_wait"
+STAGE_THROTTLE = "throttle"
+STAGE_RETRY_WAIT = "retry_wait"
+STAGE_BREAKER_WAIT = "breaker_wait"
+
+class JobTrace:
+    """Collects timing spans for a single job"""
+
+    def __init__(self, slowest_limit: int = 5):
+        self.started = time.monotonic()
+        self.slowest_limit = slowest_limit
+        # stage -> [total_seconds, count, max_seconds]
+        self.stages: Dict[str, List[float]] = {}
+        # min-heap of (seconds, message_id) holding only the slowest messages
+        self._slowest: List[Tuple[float, int]] = []
+
+    def record(self, stage: str, elapsed: float):
+        """Add one timing sample for a stage"""
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [elapsed, 1, elapsed]
+            return
+        entry[0] += elapsed
+        entry[1] += 1
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+
+    def record_message(self, message_id: int, elapsed: float):
+        """Keep track of the slowest messages without storing every sample"""
+        item = (elapsed, message_id)
+        if len(self._slowest) < self.slowest_limit:
+            heapq.heappush(self._slowest, item)
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time a block of code as one stage sample"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def message(self, message_id: int):
+        """Time the full processing of one message"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_message(message_id, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """Build a compact summary suitable for storing on the job document"""
+        stages = {
+            stage: {
+                "total": round(total, 3),
+                "count": int(count),
+                "avg": round(total / count, 3) if count else 0.0,
+                "max": round(max_seconds, 3)
+            }
+            for stage, (total, count, max_seconds) in self.stages.items()
+        }
+        slowest = [
+            {"message_id": message_id, "seconds": round(seconds, 3)}
+            for seconds, message_id in sorted(self._slowest, reverse=True)
+        ]
+        return {
+            "total_seconds": round(time.monotonic() - self.started, 3),
+            "stages": stages,
+            "slowest_messages": slowest
+        }
+
+class NullTrace(JobTrace):
+    """Trace that records nothing, used when a caller doesn't pass one"""
+
+    def record(self, stage: str, elapsed: float):
+        pass
+
+    def record_message(self, message_id: int, elapsed: float):
+        pass
+
+class ThroughputMeter:
+    """Recent per-message delivery times of this instance, used for ETAs"""
+
+    def __init__(self, window: int = 500):
+        # (seconds spent on one delivered message, its size in bytes)
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float, size: int = 0):
+        self.samples.append((seconds, size))
+
+    def seconds_per_message(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        return sum(seconds for seconds, _ in self.samples) / len(self.samples)
+
+def format_trace_summary(summary: Optional[dict]) -> str:
+    """Format a stored trace summary for a Telegram message"""
+    if not summary:
+        return "❌ No trace recorded for this job"
+
+    lines = [f"⏱️ **Total:** {summary.get('total_seconds', 0):.1f}s", "", "**Time per stage:**"]
+    stages = sorted(
+        summary.get("stages", {}).items(),
+        key=lambda item: item[1]["total"],
+        reverse=True
+    )
+    for stage, data in stages:
+        lines.append(
+            f"• `{stage}`: {data['total']:.1f}s "
+            f"({data['count']}x, avg {data['avg']:.2f}s, max {data['max']:.2f}s)"
+        )
+
+    slowest = summary.get("slowest_messages", [])
+    if slowest:
+        lines.append("")
+        lines.append("**Slowest messages:**")
+        for item in slowest:
+            lines.append(f"• #{item['message_id']}: {item['seconds']:.2f}s")
+
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+"""
+Per-job transform plan - Compiles rename/caption templates and word lists once per job
+"""
+
+import html
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import config
+from dedupe import DedupeFilter
+from utils import format_file_size, sanitize_filename
+
+TEMPLATE_VAR = re.compile(r'\{(\w+)\}')
+HTML_TAG = re.compile(r'(<[^>]*>)')
+
+RENAME_VARS = ('index', 'name', 'ext')
+CAPTION_VARS = ('filename', 'size', 'index')
+
+class CompiledTemplate:
+    """Template parsed once into literal text and variable segments"""
+
+    def __init__(self, template: str, variables: Iterable[str]):
+        allowed = set(variables)
+        # Each segment is (literal, variable name or None)
+        self.segments: List[Tuple[str, Optional[str]]] = []
+        position = 0
+        for match in TEMPLATE_VAR.finditer(template):
+            if match.group(1) not in allowed:
+                continue
+            self.segments.append((template[position:match.start()], match.group(1)))
+            position = match.end()
+        self.segments.append((template[position:], None))
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = []
+        for literal, variable in self.segments:
+            parts.append(literal)
+            if variable:
+                parts.append(values[variable])
+        return "".join(parts)
+
+def _trie_pattern(node: dict) -> str:
+    """Turn a character trie into a regex that always prefers the longest match"""
+    is_end = '' in node
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char != ''
+    ]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if is_end else pattern
+
+class WordReplacer:
+    """Replaces and removes many words in a single regex pass"""
+
+    def __init__(self, replace_words: Optional[Dict[str, str]] = None,
+                 remove_words: Optional[Iterable[str]] = None):
+        self.mapping: Dict[str, str] = {}
+        for word in remove_words or []:
+            if word:
+                self.mapping[word] = ''
+        for old, new in (replace_words or {}).items():
+            if old:
+                self.mapping[old] = new or ''
+
+        self.pattern = None
+        if self.mapping:
+            trie: dict = {}
+            for word in self.mapping:
+                node = trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                node[''] = True
+            self.pattern = re.compile(_trie_pattern(trie))
+
+    def __bool__(self):
+        return self.pattern is not None
+
+    def apply(self, text: Optional[str]) -> Optional[str]:
+        if not text or self.pattern is None:
+            return text
+        mapping = self.mapping
+        return self.pattern.sub(lambda match: mapping[match.group(0)], text)
+
+class TransformPlan:
+    """Everything a job needs to rename files and rewrite captions/text"""
+
+    def __init__(self, settings: Optional[dict] = None):
+        settings = settings or {}
+        rename_format = settings.get('rename_format')
+        custom_caption = settings.get('custom_caption')
+        self.rename = CompiledTemplate(rename_format, RENAME_VARS) if rename_format else None
+        self.caption_template = CompiledTemplate(custom_caption, CAPTION_VARS) if custom_caption else None
+        self.words = WordReplacer(settings.get('replace_words'), settings.get('remove_words'))
+        # Local path of the processed custom thumbnail, resolved once per job by the extractor
+        self.thumb_path: Optional[str] = None
+        # WatermarkPipeline for photo posts, set by the extractor when a watermark is configured
+        self.watermark = None
+        self.dedupe = DedupeFilter(config.DEDUPE_MAX_KEYS) if settings.get('dedupe') else None
+        # Source index buffer and IDs it knows are deleted, set by the extractor
+        self.index = None
+        self.known_missing: Set[int] = set()
+
+    def file_name(self, original_name: str, index: int = 0) -> str:
+        """Apply rename format, variables: {index}, {name}, {ext}"""
+        if not self.rename:
+            return original_name
+        if '.' in original_name:
+            name, ext = original_name.rsplit('.', 1)
+        else:
+            name, ext = original_name, ''
+        return sanitize_filename(self.rename.render({
+            'index': str(index),
+            'name': name,
+            'ext': ext
+        }))
+
+    def caption(self, original_caption: Optional[str], file_name: str,
+                file_size: int, index: int = 0) -> Optional[str]:
+        """Build the caption for a media message"""
+        if self.caption_template:
+            caption = self.caption_template.render({
+                'filename': file_name,
+                'size': format_file_size(file_size),
+                'index': str(index)
+            })
+        else:
+            caption = original_caption
+        return self.words.apply(caption)
+
+    def text(self, text: Optional[str]) -> Optional[str]:
+        """Rewrite a text message"""
+        return self.words.apply(text)
+
+    def text_html(self, html_text: str) -> str:
+        """Rewrite the text between tags of a message's HTML, formatting and link URLs stay as they are"""
+        parts = HTML_TAG.split(html_text)
+        # Even parts are text, odd parts are tags
+        for i in range(0, len(parts), 2):
+            if parts[i]:
+                parts[i] = html.escape(self.words.apply(html.unescape(parts[i])), quote=False)
+        return "".join(parts)
@@ -0,0 +1,95 @@
+"""
+Update processor - Handles different users' updates concurrently, each user's updates in order
+"""
+
+from typing import Any, Awaitable, Dict, List
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Commands that must get through while the same user's long handler (e.g. /dl) is running
+BYPASS_COMMANDS = ("/cancel",)
+# Cap handed to the base class, whose semaphore is taken before the per-user lock
+UNBOUNDED = 2 ** 30
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Concurrent updates capped at max_concurrent_updates, serialized per user
+    Keeps ConversationHandler state (login, batch) consistent while users are served in parallel
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # The base class takes its slot before do_process_update, so one user's backlog would
+        # hold every slot. Its cap is left out of the way and the real one is taken after the
+        # user's lock instead.
+        super().__init__(UNBOUNDED)
+        self.max_concurrent = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # user/chat key -> [lock, updates holding or waiting for it]
+        self._locks: Dict[int, List[Any]] = {}
+        self.in_flight = 0
+        self.processed = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def _key(update: object):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @staticmethod
+    def _bypasses_order(update: object) -> bool:
+        message = update.effective_message if isinstance(update, Update) else None
+        text = (message.text or "") if message else ""
+        return text.split("@")[0].split(" ")[0] in BYPASS_COMMANDS
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Wait for the user's turn, then for a concurrency slot"""
+        key = self._key(update)
+        if key is None or self._bypasses_order(update):
+            if key is not None:
+                self.bypassed += 1
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        self.in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def state(self) -> dict:
+        """Live counts for /health"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "users_active": len(self._locks),
+            "processed": self.processed,
+            "bypassed": self.bypassed
+        }
@@ -0,0 +1,195 @@
+"""
+Upload subsystem - Sends files through the Bot API or the user's MTProto client
+Large files go through the user client, uploaded in parallel parts with async file I/O
+"""
+
+import asyncio
+import math
+import mimetypes
+import os
+import random
+import time
+from typing import Callable, Optional, TYPE_CHECKING
+import aiofiles
+import aiofiles.os
+import config
+from utils import create_progress_message
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+
+# settings['upload_method'] values
+UPLOAD_AUTO = "auto"  # Bot API when the file fits, user client otherwise
+UPLOAD_BOT = "bot"
+UPLOAD_USER = "user"
+UPLOAD_METHODS = (UPLOAD_AUTO, UPLOAD_BOT, UPLOAD_USER)
+
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024  # MTProto requires SaveBigFilePart above this
+PART_RETRIES = 3
+
+class UploadError(Exception):
+    """Upload can't be done with the available methods"""
+
+def choose_upload_method(file_size: int, preference: Optional[str], has_client: bool) -> str:
+    """Pick Bot API or user client for a file"""
+    if file_size > config.MAX_FILE_SIZE:
+        raise UploadError(f"File is larger than {config.MAX_FILE_SIZE // (1024 * 1024)} MB")
+    fits_bot_api = file_size <= config.BOT_API_UPLOAD_LIMIT
+    if has_client and (preference == UPLOAD_USER or not fits_bot_api):
+        return UPLOAD_USER
+    if not fits_bot_api:
+        raise UploadError("Files over 50 MB need a logged in account, use /login")
+    return UPLOAD_BOT
+
+async def _read_file(path: str) -> bytes:
+    async with aiofiles.open(path, 'rb') as f:
+        return await f.read()
+
+async def upload_with_bot(bot, chat_id: int, file_path: str, kind: str,
+                          caption: Optional[str] = None, thumb_path: Optional[str] = None,
+                          meta: Optional[dict] = None):
+    """Send a file up to 50 MB through the Bot API"""
+    meta = meta or {}
+    data = await _read_file(file_path)
+    thumb = await _read_file(thumb_path) if thumb_path else None
+    file_name = meta.get('file_name') or os.path.basename(file_path)
+    if kind == 'video':
+        return await bot.send_video(
+            chat_id, video=data, filename=file_name, caption=caption, thumbnail=thumb,
+            duration=meta.get('duration'), width=meta.get('width'), height=meta.get('height'),
+            supports_streaming=True
+        )
+    if kind == 'audio':
+        return await bot.send_audio(
+            chat_id, audio=data, filename=file_name, caption=caption, thumbnail=thumb,
+            duration=meta.get('duration'), performer=meta.get('performer'), title=meta.get('title')
+        )
+    return await bot.send_document(chat_id, document=data, filename=file_name, caption=caption, thumbnail=thumb)
+
+async def save_file_parts(client: "Client", file_path: str,
+                          progress: Optional[Callable] = None, workers: Optional[int] = None):
+    """
+    Upload a file to Telegram in parallel 512 KB parts
+    Returns the raw InputFile/InputFileBig to attach to a message
+    """
+    from pyrogram import raw
+    from pyrogram.errors import FloodWait
+
+    file_size = (await aiofiles.os.stat(file_path)).st_size
+    part_size = config.UPLOAD_PART_SIZE
+    total_parts = max(1, math.ceil(file_size / part_size))
+    is_big = file_size > BIG_FILE_THRESHOLD
+    file_id = random.getrandbits(63)
+    next_part = 0
+    uploaded = 0
+
+    async def worker():
+        nonlocal next_part, uploaded
+        # Each worker has its own handle, reads never block the event loop
+        async with aiofiles.open(file_path, 'rb') as f:
+            while next_part < total_parts:
+                part = next_part
+                next_part += 1
+                await f.seek(part * part_size)
+                chunk = await f.read(part_size)
+                if is_big:
+                    rpc = raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=chunk
+                    )
+                else:
+                    rpc = raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=chunk)
+
+                for attempt in range(1, PART_RETRIES + 1):
+                    try:
+                        await client.invoke(rpc)
+                        break
+                    except FloodWait as e:
+                        await asyncio.sleep(e.value)
+                    except Exception:
+                        if attempt == PART_RETRIES:
+                            raise
+                        await asyncio.sleep(attempt)
+                else:
+                    raise UploadError(f"Part {part} kept hitting flood limits")
+
+                uploaded += len(chunk)
+                if progress:
+                    await progress(uploaded, file_size)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(min(workers or config.UPLOAD_WORKERS, total_parts))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    name = os.path.basename(file_path)
+    if is_big:
+        return raw.types.InputFileBig(id=file_id, parts=total_parts, name=name)
+    # md5 is optional for small files
+    return raw.types.InputFile(id=file_id, parts=total_parts, name=name, md5_checksum="")
+
+async def upload_with_client(client: "Client", chat_id, file_path: str, kind: str,
+                             caption: Optional[str] = None, thumb_path: Optional[str] = None,
+                             meta: Optional[dict] = None, progress: Optional[Callable] = None):
+    """Send a file up to config.MAX_FILE_SIZE through the user's MTProto client"""
+    from pyrogram import raw, utils
+
+    meta = meta or {}
+    file_name = meta.get('file_name') or os.path.basename(file_path)
+    input_file = await save_file_parts(client, file_path, progress)
+    thumb = await save_file_parts(client, thumb_path, workers=1) if thumb_path else None
+
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if kind == 'video':
+        attributes.append(raw.types.DocumentAttributeVideo(
+            duration=meta.get('duration') or 0,
+            w=meta.get('width') or 0,
+            h=meta.get('height') or 0,
+            supports_streaming=True
+        ))
+    elif kind == 'audio':
+        attributes.append(raw.types.DocumentAttributeAudio(
+            duration=meta.get('duration') or 0,
+            performer=meta.get('performer'),
+            title=meta.get('title')
+        ))
+
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+        file=input_file,
+        thumb=thumb,
+        attributes=attributes,
+        force_file=kind == 'document' or None
+    )
+    # Same caption parsing as Pyrogram's send_* methods
+    text = await utils.parse_text_entities(client, caption or "", None, None)
+    await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        message=text["message"],
+        entities=text["entities"],
+        random_id=random.getrandbits(63)
+    ))
+
+def make_upload_progress(progress_callback: Callable, interval: float = 2):
+    """Throttled progress reporter in the same format as downloads"""
+    start_time = time.time()
+    last_update = 0
+
+    async def report(current: int, total: int):
+        nonlocal last_update
+        now = time.time()
+        if now - last_update < interval and current < total:
+            return
+        last_update = now
+        elapsed = now - start_time
+        speed = current / elapsed if elapsed > 0 else 0
+        eta = int((total - current) / speed) if speed > 0 else 0
+        await progress_callback(
+            create_progress_message(current, total, current, total, speed, eta, "Uploading...")
+        )
+
+    return report
@@ -68,7 +68,8 @@ def calculate_percentage(current: int, total: int) -> float:
     return (current / total) * 100
 
 def create_progress_message(current: int, total: int, downloaded_bytes: int, 
-                           total_bytes: int, speed: float, eta: int) -> str:
+                           total_bytes: int, speed: float, eta: int,
+                           title: str = "Downloading...") -> str:
     """
     Create beautiful progress message like the reference bot
     """
@@ -76,7 +77,7 @@ def create_progress_message(current: int, total: int, downloaded_bytes: int,
     percentage = calculate_percentage(downloaded_bytes, total_bytes)
     
     message = f"""╭─────────────────────╮
-│      Downloading...
+│      {title}
 ├─────────────────────
 │ {progress_bar}
 
@@ -95,6 +96,17 @@ Processing: {current}/{total}
 
 **Powered by RATNA**"""
 
+def format_failed_ids(message_ids: list, limit: int = 20) -> str:
+    """List permanently failed message IDs for the completion report"""
+    if not message_ids:
+        return ""
+    shown = ", ".join(str(message_id) for message_id in message_ids[:limit])
+    more = f" ... +{len(message_ids) - limit} more" if len(message_ids) > limit else ""
+    return f"""
+⚠️ **Failed IDs:** `{shown}`{more}
+Use /retry to run them again.
+"""
+
 def sanitize_filename(filename: str) -> str:
     """Remove invalid characters from filename"""
     # Remove invalid characters
@@ -107,42 +119,6 @@ def sanitize_filename(filename: str) -> str:
         filename = name[:200-len(ext)-1] + '.' + ext if ext else name[:200]
     return filename
 
-def apply_rename_format(original_name: str, rename_format: str, index: int = 0) -> str:
-    """
-    Apply custom rename format
-    Variables: {index}, {name}, {ext}
-    """
-    if not rename_format:
-        return original_name
-    
-    # Split name and extension
-    if '.' in original_name:
-        name, ext = original_name.rsplit('.', 1)
-    else:
-        name, ext = original_name, ''
-    
-    # Replace variables
-    new_name = rename_format.replace('{index}', str(index))
-    new_name = new_name.replace('{name}', name)
-    new_name = new_name.replace('{ext}', ext)
-    
-    return sanitize_filename(new_name)
-
-def apply_caption_format(caption_template: str, file_name: str, file_size: int, 
-                        index: int = 0) -> str:
-    """
-    Apply custom caption format
-    Variables: {filename}, {size}, {index}
-    """
-    if not caption_template:
-        return None
-    
-    caption = caption_template.replace('{filename}', file_name)
-    caption = caption.replace('{size}', format_file_size(file_size))
-    caption = caption.replace('{index}', str(index))
-    
-    return caption
-
 def validate_chat_id(chat_id: str) -> Optional[int]:
     """Validate and convert chat ID"""
     try:
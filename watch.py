@@ -0,0 +1,452 @@
+"""
+Watch mode - Mirrors new posts of a source chat to the user's destination as they are published
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import config
+from database import db
+from delivery_ledger import DeliveryLedger
+from extractor import extractor, SENT, DUPLICATE
+from peer_cache import peer_cache, chat_key
+from retry import classify_error, ACCESS, PERMANENT
+from tracing import NullTrace
+import source_index
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# Pyrogram handler group for watch handlers, each one filters on its own source chat
+HANDLER_GROUP = 10
+# get_messages takes at most this many IDs per call
+FETCH_CHUNK = 200
+
+def split_albums(messages: List["Message"]) -> List[List["Message"]]:
+    """Consecutive posts of one album together, every other post on its own"""
+    groups: List[List["Message"]] = []
+    for message in messages:
+        group_id = message.media_group_id
+        if group_id and groups and groups[-1][0].media_group_id == group_id:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return groups
+
+class WatchStopped(Exception):
+    """The watch can't continue until the user fixes something, message is sent to them"""
+
+class LeaseLost(Exception):
+    """Another process runs this watch now, or it was removed"""
+
+class SourceWatch:
+    """
+    Mirrors one source chat for one user
+    The Pyrogram handler only queues new posts, a single runner sends them in bursts and in ID order
+    Posts missed while the bot was down (or dropped by Telegram) are fetched from the last mirrored ID
+    """
+
+    def __init__(self, manager: "WatchManager", record: dict):
+        self.manager = manager
+        self.user_id = record['user_id']
+        self.source = record['source']
+        self.chat_id = record['chat_id']
+        self.destination = record['destination']
+        self.last_message_id = record.get('last_message_id', 0)
+        self.delivered = record.get('delivered', 0)
+        self.failed = record.get('failed', 0)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.client = None
+        self.settings: dict = {}
+        self.plan = None
+        self.ledger: Optional[DeliveryLedger] = None
+        self.trace = NullTrace()
+        self._handler = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return (self.user_id, self.source)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except WatchStopped as e:
+                await self.manager.stopped(self, str(e))
+                return
+            except LeaseLost:
+                logger.info(f"Watch {self.source} of {self.user_id} is no longer leased to this process")
+                self.manager.forget(self)
+                return
+            except Exception as e:
+                if classify_error(e) == ACCESS:
+                    await self.manager.stopped(self, f"❌ Lost access to the source chat: {e}")
+                    return
+                logger.error(f"Watch {self.source} of {self.user_id} failed, restarting: {e}")
+            finally:
+                await self._detach()
+            await asyncio.sleep(config.WATCH_RESTART_DELAY)
+
+    async def _watch(self):
+        self.client = await extractor.get_user_client(self.user_id)
+        if not self.client:
+            raise WatchStopped("❌ Please login first using /login")
+        access_error = await peer_cache.check_access(self.user_id, self.client, self.chat_id)
+        if access_error:
+            raise WatchStopped(access_error)
+
+        # Settings are read when the watch starts, /watch again picks up changes
+        self.settings = await db.get_settings(self.user_id)
+        self.plan = await extractor.build_plan(self.user_id, self.settings, self.trace)
+        self.plan.index = source_index.IndexBuffer(self.chat_id, self.user_id)
+        self.ledger = await DeliveryLedger.load(self.chat_id, self.destination) if config.DELIVERY_LEDGER else None
+        if self.plan.watermark:
+            self.plan.watermark.on_done = self._photo_done
+
+        # Listen before catching up, posts published meanwhile wait in the queue
+        from pyrogram import filters
+        from pyrogram.handlers import MessageHandler
+        chat = await self.client.get_chat(self.chat_id)
+        self._handler = MessageHandler(self._on_message, filters.chat(chat.id) & ~filters.service)
+        self.client.add_handler(self._handler, HANDLER_GROUP)
+
+        await self._catch_up()
+        while True:
+            await self._mirror(await self._next_burst())
+
+    async def _detach(self):
+        if self._handler and self.client:
+            try:
+                self.client.remove_handler(self._handler, HANDLER_GROUP)
+            except Exception as e:
+                logger.warning(f"Error removing watch handler: {e}")
+        self._handler = None
+        if self.plan:
+            if self.plan.watermark:
+                self.plan.watermark.cancel()
+            try:
+                await self.plan.index.flush()
+            except Exception as e:
+                logger.warning(f"Error saving source index: {e}")
+            self.plan = None
+
+    async def _on_message(self, client, message: "Message"):
+        self.queue.put_nowait(message)
+
+    async def _next_burst(self) -> List["Message"]:
+        """Wait for a post, then take everything that arrives until the source goes quiet"""
+        messages = [await self.queue.get()]
+        deadline = time.monotonic() + config.WATCH_BURST_MAX_WAIT
+        # Past the size limit only an album still arriving is waited for, so it is sent whole
+        while len(messages) < config.WATCH_BURST_SIZE or messages[-1].media_group_id:
+            timeout = min(config.WATCH_BURST_DELAY, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            try:
+                messages.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return messages
+
+    async def _newest_message_id(self) -> int:
+        async for message in self.client.get_chat_history(self.chat_id, limit=1):
+            return message.id
+        return 0
+
+    async def _fetch(self, message_ids: List[int]) -> List["Message"]:
+        """Fetch posts by ID, deleted and service messages are left out"""
+        from pyrogram.errors import FloodWait
+        while True:
+            try:
+                messages = await self.client.get_messages(self.chat_id, message_ids)
+                break
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+        for message_id, message in zip(message_ids, messages):
+            self.plan.index.add(message_id, message)
+        return [m for m in messages if m and not m.empty and not m.service]
+
+    async def _catch_up(self):
+        """Mirror what was posted since the last mirrored ID, at most WATCH_CATCHUP_LIMIT posts"""
+        newest = await self._newest_message_id()
+        if newest <= self.last_message_id:
+            return
+        start = max(self.last_message_id + 1, newest - config.WATCH_CATCHUP_LIMIT + 1)
+        if start > self.last_message_id + 1:
+            logger.info(f"Watch {self.source} of {self.user_id} skips {start - self.last_message_id - 1} old posts")
+        held: List["Message"] = []
+        for offset in range(start, newest + 1, FETCH_CHUNK):
+            message_ids = list(range(offset, min(offset + FETCH_CHUNK, newest + 1)))
+            messages = held + await self._fetch(message_ids)
+            up_to = message_ids[-1]
+            # An album at the end of a chunk may go on in the next one, hold it back until then
+            held = []
+            if up_to < newest and messages and messages[-1].media_group_id:
+                held = split_albums(messages)[-1]
+                messages = messages[:-len(held)]
+                up_to = held[0].id - 1
+            await self._deliver(messages, up_to)
+
+    async def _mirror(self, burst: List["Message"]):
+        """Send one burst, plus any posts between the last mirrored ID and it that never reached the handler"""
+        by_id: Dict[int, "Message"] = {}
+        for message in burst:
+            if message.id > self.last_message_id:
+                by_id[message.id] = message
+                self.plan.index.add(message.id, message)
+        if not by_id:
+            return
+        newest = max(by_id)
+        gap_start = max(self.last_message_id + 1, newest - config.WATCH_CATCHUP_LIMIT + 1)
+        gap = [message_id for message_id in range(gap_start, newest) if message_id not in by_id]
+        for offset in range(0, len(gap), FETCH_CHUNK):
+            for message in await self._fetch(gap[offset:offset + FETCH_CHUNK]):
+                by_id[message.id] = message
+        await self._deliver([by_id[message_id] for message_id in sorted(by_id)], newest)
+
+    async def _deliver(self, messages: List["Message"], up_to: int):
+        """Send posts in order, albums as one album, then checkpoint everything up to the given ID"""
+        for album in split_albums(messages):
+            pending = [m for m in album if not (self.ledger and m.id in self.ledger)]
+            if len(album) > 1 and len(pending) == len(album) and await self._send_album(album):
+                continue
+            for message in pending:
+                result = await self._send(message)
+                if result == SENT:
+                    self.delivered += 1
+                if result in (SENT, DUPLICATE) and self.ledger:
+                    self.ledger.record(message.id)
+
+        # Watermarked photos are counted by _photo_done, before the checkpoint below
+        if self.plan.watermark:
+            await self.plan.watermark.flush()
+            self.plan.watermark.failed_ids.clear()
+
+        self.last_message_id = max(self.last_message_id, up_to)
+        leased, _, _ = await asyncio.gather(
+            db.update_watch(
+                self.user_id, self.source,
+                owner=self.manager.owner_id,
+                last_message_id=self.last_message_id,
+                delivered=self.delivered,
+                failed=self.failed
+            ),
+            self.ledger.save() if self.ledger else asyncio.sleep(0),
+            self.plan.index.flush()
+        )
+        if not leased:
+            raise LeaseLost()
+
+    def _photo_done(self, message_id: int, uploaded: bool):
+        if not uploaded:
+            self.failed += 1
+            return
+        self.delivered += 1
+        if self.ledger:
+            self.ledger.record(message_id)
+
+    async def _send(self, message: "Message") -> Optional[str]:
+        """Send one post, retrying transient errors; None when it failed for good"""
+        result = await self._retrying(message.id, lambda: extractor.send_message(
+            self.client, message, self.destination, self.user_id,
+            self.settings, self.delivered + 1, self.trace, self.plan
+        ))
+        if result is None:
+            self.failed += 1
+        return result
+
+    async def _send_album(self, album: List["Message"]) -> bool:
+        """Copy an album in one request, False when its posts have to go one by one"""
+        sent = await self._retrying(album[0].id, lambda: extractor.send_media_group(
+            self.client, album, self.destination, self.delivered + 1, self.trace, self.plan
+        ))
+        if not sent:
+            return False
+        self.delivered += len(album)
+        if self.ledger:
+            for message in album:
+                self.ledger.record(message.id)
+        return True
+
+    async def _retrying(self, message_id: int, send):
+        """Run a send, retrying transient errors; None when it failed for good"""
+        from pyrogram.errors import FloodWait
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return await send()
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == ACCESS:
+                    raise
+                if kind == PERMANENT or attempts >= config.RETRY_MAX_ATTEMPTS:
+                    logger.warning(f"Watch {self.source} of {self.user_id} failed on message {message_id}: {e}")
+                    return None
+                await asyncio.sleep(min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** (attempts - 1)))
+
+class WatchManager:
+    """
+    Running watches of this process by (user ID, source chat key)
+    Watches are leased like extraction jobs, so each one runs in exactly one bot process
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._watches: Dict[Tuple[int, str], SourceWatch] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._watches)
+
+    def state(self) -> dict:
+        """Live counts for /health"""
+        return {
+            "owner_id": self.owner_id,
+            "running": len(self._watches),
+            "users": len({user_id for user_id, _ in self._watches}),
+            "queued_posts": sum(watch.queue.qsize() for watch in self._watches.values())
+        }
+
+    def get(self, user_id: int, chat_id) -> Optional[SourceWatch]:
+        return self._watches.get((user_id, chat_key(chat_id)))
+
+    def start(self, bot) -> asyncio.Task:
+        """Claim and run watches in this process; each claimed watch catches up on its own"""
+        self.bot = bot
+        self._task = asyncio.create_task(self._lease_loop())
+        return self._task
+
+    async def _lease_loop(self):
+        while True:
+            try:
+                await self._renew_leases()
+                await self._claim_watches()
+            except Exception as e:
+                logger.error(f"Watch lease error: {e}")
+            await asyncio.sleep(config.WATCH_HEARTBEAT_SECONDS)
+
+    async def _renew_leases(self):
+        for key, watch in list(self._watches.items()):
+            alive = await db.renew_watch_lease(
+                watch.user_id, watch.source, self.owner_id, config.WATCH_LEASE_SECONDS
+            )
+            if not alive:
+                # Removed, stopped or restarted through another instance
+                logger.info(f"Lost lease on watch {watch.source} of {watch.user_id}, stopping")
+                await self._stop(key)
+
+    async def _claim_watches(self):
+        claimed = 0
+        while True:
+            record = await db.claim_watch(self.owner_id, config.WATCH_LEASE_SECONDS)
+            if not record:
+                break
+            if (record['user_id'], record['source']) not in self._watches:
+                self._launch(record)
+                claimed += 1
+        if claimed:
+            logger.info(f"Claimed {claimed} watches")
+
+    def _launch(self, record: dict):
+        watch = SourceWatch(self, record)
+        self._watches[watch.key] = watch
+        watch.start()
+
+    def forget(self, watch: SourceWatch):
+        if self._watches.get(watch.key) is watch:
+            del self._watches[watch.key]
+
+    async def add(self, user_id: int, chat_id, last_message_id: int, destination: int) -> Optional[str]:
+        """Mirror posts after last_message_id, returns an error message if the chat can't be watched"""
+        client = await extractor.get_user_client(user_id)
+        if not client:
+            return "❌ Please login first using /login"
+        access_error = await peer_cache.check_access(user_id, client, chat_id, recheck=True)
+        if access_error:
+            return access_error
+
+        # Runs here when this process runs watches, otherwise one that does claims it;
+        # a copy running elsewhere loses its lease and stops
+        source = chat_key(chat_id)
+        await self._stop((user_id, source))
+        owner = self.owner_id if self._task else None
+        record = await db.save_watch(
+            user_id, source, chat_id, destination, last_message_id,
+            owner=owner, lease_seconds=config.WATCH_LEASE_SECONDS
+        )
+        if owner:
+            self._launch(record)
+        return None
+
+    async def remove(self, user_id: int, chat_id) -> bool:
+        source = chat_key(chat_id)
+        await self._stop((user_id, source))
+        return await db.delete_watch(user_id, source)
+
+    async def stop_user(self, user_id: int, error: str):
+        """Stop every watch of a user and keep them listed as stopped"""
+        for key in [key for key in self._watches if key[0] == user_id]:
+            await self._stop(key)
+        await db.deactivate_user_watches(user_id, error)
+
+    async def stopped(self, watch: SourceWatch, error: str):
+        """A watch gave up, record why and tell its owner"""
+        self.forget(watch)
+        await db.update_watch(watch.user_id, watch.source, active=False, error=error)
+        if not self.bot:
+            return
+        try:
+            # Plain text, errors carry Pyrogram text like [400 CHANNEL_PRIVATE]
+            await self.bot.send_message(
+                watch.user_id,
+                f"⚠️ Watch stopped for {watch.source}\n\n{error}\n\nFix it and send /watch again."
+            )
+        except Exception as e:
+            logger.warning(f"Error notifying {watch.user_id} about a stopped watch: {e}")
+
+    async def _stop(self, key: Tuple[int, str]):
+        watch = self._watches.pop(key, None)
+        if watch:
+            await watch.stop()
+
+    async def shutdown(self):
+        """Stop runners and hand the leases back, records stay active so another start catches up"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        watches = list(self._watches.values())
+        self._watches.clear()
+        await asyncio.gather(*(watch.stop() for watch in watches), return_exceptions=True)
+        if watches:
+            await db.release_watches(self.owner_id)
+
+# Global watch manager
+watches = WatchManager()
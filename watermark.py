@@ -0,0 +1,181 @@
+"""
+Photo watermarking - Pillow compositing in a process pool, pipelined with download and upload
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+import config
+from tracing import JobTrace, STAGE_DOWNLOAD, STAGE_UPLOAD, STAGE_WATERMARK, STAGE_FLOOD_WAIT
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_MAX_SIDE = 1024
+SCALED_CACHE_LIMIT = 32
+
+# ===== WORKER PROCESS SIDE =====
+# Decoded assets live for the lifetime of each worker process
+_assets: Dict[str, object] = {}
+# (asset path, width, opacity) -> resized watermark, photos in a batch usually share a size
+_scaled: Dict[Tuple[str, int, float], object] = {}
+
+def prepare_watermark(data: bytes) -> bytes:
+    """Normalize an uploaded watermark to a bounded RGBA PNG (run in a thread)"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGBA")
+        image.thumbnail((WATERMARK_MAX_SIDE, WATERMARK_MAX_SIDE))
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+def _load_asset(asset_path: str):
+    asset = _assets.get(asset_path)
+    if asset is None:
+        from PIL import Image
+        with Image.open(asset_path) as image:
+            asset = image.convert("RGBA")
+        _assets[asset_path] = asset
+    return asset
+
+def _scaled_asset(asset_path: str, width: int, opacity: float):
+    key = (asset_path, width, opacity)
+    mark = _scaled.get(key)
+    if mark is None:
+        from PIL import Image
+        asset = _load_asset(asset_path)
+        height = max(1, round(asset.height * width / asset.width))
+        mark = asset.resize((width, height), Image.LANCZOS)
+        if opacity < 1:
+            alpha = mark.getchannel("A").point(lambda a: int(a * opacity))
+            mark.putalpha(alpha)
+        if len(_scaled) >= SCALED_CACHE_LIMIT:
+            _scaled.pop(next(iter(_scaled)))
+        _scaled[key] = mark
+    return mark
+
+def apply_watermark(photo_path: str, asset_path: str, output_path: str,
+                    scale: float, opacity: float) -> str:
+    """Composite the watermark onto the bottom-right corner of a photo (run in a worker process)"""
+    from PIL import Image, ImageOps
+    with Image.open(photo_path) as image:
+        photo = ImageOps.exif_transpose(image).convert("RGB")
+    width = max(1, int(photo.width * scale))
+    mark = _scaled_asset(asset_path, width, opacity)
+    margin = max(4, photo.width // 50)
+    position = (
+        max(0, photo.width - mark.width - margin),
+        max(0, photo.height - mark.height - margin)
+    )
+    photo.paste(mark, position, mark)
+    photo.save(output_path, "JPEG", quality=90)
+    return output_path
+
+# ===== BOT SIDE =====
+_executor: Optional[ProcessPoolExecutor] = None
+
+def get_executor() -> ProcessPoolExecutor:
+    """Process pool created on first use, spawned so workers don't inherit the bot's loop and clients"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=config.WATERMARK_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+class WatermarkPipeline:
+    """
+    Download -> watermark -> upload for the photo posts of one job
+    The next photo downloads while earlier ones are composited and uploaded, uploads keep source order
+    """
+
+    def __init__(self, asset_path: str, trace: JobTrace, depth: int):
+        self.asset_path = asset_path
+        self.trace = trace
+        self._slots = asyncio.Semaphore(depth)
+        self._last: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.failed_ids: List[int] = []
+        # Called with (message ID, uploaded) once a photo is done; photos dropped by cancel() never report
+        self.on_done: Optional[Callable[[int, bool], None]] = None
+
+    async def submit(self, message: "Message", destination: int, caption: Optional[str], work_dir: str):
+        """Download a photo and hand it to the pool, returns before it is uploaded"""
+        await self._slots.acquire()
+        try:
+            with self.trace.span(STAGE_DOWNLOAD):
+                photo_path = await message.download(file_name=os.path.join(work_dir, "photo.jpg"))
+        except BaseException:
+            self._slots.release()
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+            raise
+
+        task = asyncio.create_task(
+            self._finish(message, destination, caption, work_dir, photo_path, self._last)
+        )
+        self._last = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _finish(self, message: "Message", destination: int, caption: Optional[str],
+                      work_dir: str, photo_path: str, previous: Optional[asyncio.Task]):
+        try:
+            loop = asyncio.get_running_loop()
+            with self.trace.span(STAGE_WATERMARK):
+                output_path = await loop.run_in_executor(
+                    get_executor(), apply_watermark, photo_path, self.asset_path,
+                    os.path.join(work_dir, "watermarked.jpg"),
+                    config.WATERMARK_SCALE, config.WATERMARK_OPACITY
+                )
+            if previous:
+                await asyncio.wait([previous])
+            with self.trace.span(STAGE_UPLOAD):
+                await self._upload(message, destination, output_path, caption)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error watermarking message {message.id}: {e}")
+            self.failed_ids.append(message.id)
+            self._report(message.id, False)
+        else:
+            self._report(message.id, True)
+        finally:
+            self._slots.release()
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    def _report(self, message_id: int, uploaded: bool):
+        if self.on_done:
+            self.on_done(message_id, uploaded)
+
+    async def _upload(self, message: "Message", destination: int, path: str, caption: Optional[str]):
+        from pyrogram.errors import FloodWait
+        try:
+            await message._client.send_photo(destination, path, caption=caption)
+        except FloodWait as e:
+            with self.trace.span(STAGE_FLOOD_WAIT):
+                await asyncio.sleep(e.value)
+            await message._client.send_photo(destination, path, caption=caption)
+
+    async def flush(self):
+        """Wait until every submitted photo is uploaded (or failed)"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
@@ -0,0 +1,138 @@
+"""
+Web server - Health/keepalive HTTP endpoints served on the bot's event loop
+"""
+
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+START_TIME = time.time()
+
+# Name -> callable returning a dict of live in-process state for /health
+health_providers: Dict[str, Callable[[], dict]] = {}
+
+HOME_PAGE = """<html>
+<head>
+    <title>Extractor Bot - Running</title>
+    <style>
+        body {
+            margin: 0;
+            padding: 0;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            min-height: 100vh;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+        }
+        .container {
+            text-align: center;
+            background: rgba(255, 255, 255, 0.1);
+            backdrop-filter: blur(10px);
+            border-radius: 20px;
+            padding: 50px;
+            box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
+            border: 1px solid rgba(255, 255, 255, 0.2);
+        }
+        h1 {
+            color: white;
+            font-size: 3em;
+            margin: 0;
+            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+        }
+        .status {
+            color: #4ade80;
+            font-size: 1.5em;
+            margin: 20px 0;
+            animation: pulse 2s infinite;
+        }
+        @keyframes pulse {
+            0%, 100% { opacity: 1; }
+            50% { opacity: 0.5; }
+        }
+        .info {
+            color: white;
+            font-size: 1.1em;
+            margin: 15px 0;
+        }
+        .badge {
+            display: inline-block;
+            background: rgba(255, 255, 255, 0.2);
+            padding: 10px 20px;
+            border-radius: 25px;
+            margin: 10px 5px;
+            color: white;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🚀 Extractor Bot</h1>
+        <div class="status">🟢 Bot is Running</div>
+        <div class="info">Advanced Telegram Content Extraction Bot</div>
+        <div class="info">
+            <span class="badge">⚡ Fast Extraction</span>
+            <span class="badge">🔒 Secure</span>
+            <span class="badge">💎 Premium Features</span>
+        </div>
+        <div class="info" style="margin-top: 30px; font-size: 0.9em; opacity: 0.8;">
+            Powered by RATNA ❤️
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+def register_health_provider(name: str, provider: Callable[[], dict]):
+    """Expose extra live state under /health"""
+    health_providers[name] = provider
+
+async def home(request: web.Request) -> web.Response:
+    """Landing page"""
+    return web.Response(text=HOME_PAGE, content_type="text/html")
+
+async def health(request: web.Request) -> web.Response:
+    """Health check endpoint for monitoring"""
+    data = {
+        "status": "healthy",
+        "bot": "running",
+        "timestamp": datetime.now().isoformat(),
+        "uptime_seconds": int(time.time() - START_TIME)
+    }
+    for name, provider in health_providers.items():
+        try:
+            data[name] = provider()
+        except Exception as e:
+            logger.error(f"Health provider {name} failed: {e}")
+            data[name] = {"error": str(e)}
+    return web.json_response(data)
+
+async def ping(request: web.Request) -> web.Response:
+    """Simple ping endpoint for UptimeRobot"""
+    return web.Response(text="pong")
+
+def create_app() -> web.Application:
+    """Build the aiohttp application"""
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ping", ping)
+    return app
+
+async def start_web_server(app: web.Application, port: int) -> web.AppRunner:
+    """Start serving the app on the running event loop"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host="0.0.0.0", port=port)
+    await site.start()
+    logger.info(f"✅ Web server started on port {port}")
+    return runner
+
+async def stop_web_server(runner: Optional[web.AppRunner]):
+    """Stop the web server"""
+    if runner:
+        await runner.cleanup()
@@ -0,0 +1,79 @@
+"""
+Webhook mode - Receives Telegram updates on the shared aiohttp web server
+"""
+
+import asyncio
+import hmac
+import logging
+import signal
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def get_webhook_url() -> str:
+    """Full public URL Telegram should post updates to"""
+    return config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH
+
+def create_webhook_handler(application: Application, secret_token: str):
+    """Build the aiohttp handler that queues incoming updates"""
+    async def handle_update(request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received, secret_token):
+            logger.warning("Rejected webhook request with invalid secret token")
+            return web.Response(status=403)
+        
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        
+        # Acknowledge right away, the application processes the queue in the background
+        update = Update.de_json(data, application.bot)
+        application.update_queue.put_nowait(update)
+        return web.Response()
+    
+    return handle_update
+
+def add_webhook_route(app: web.Application, application: Application):
+    """Mount the webhook endpoint on the web server"""
+    app.router.add_post(
+        config.WEBHOOK_PATH,
+        create_webhook_handler(application, config.WEBHOOK_SECRET)
+    )
+
+async def run_webhook(application: Application):
+    """Run the application in webhook mode until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    
+    await application.bot.set_webhook(
+        url=get_webhook_url(),
+        allowed_updates=Update.ALL_TYPES,
+        secret_token=config.WEBHOOK_SECRET
+    )
+    logger.info(f"✅ Webhook set to {get_webhook_url()}")
+    
+    await application.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,43 @@
+"""
+Standalone extraction worker - Runs queued jobs without handling bot updates
+Start as many of these as needed against the same MongoDB: python worker.py
+"""
+
+import asyncio
+import logging
+import signal
+from telegram import Bot
+import config
+from database import db
+from job_queue import JobWorker
+from watermark import shutdown_executor
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+async def run_worker():
+    """Run the job worker until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    
+    await db.init_db(background=config.FAST_STARTUP)
+    
+    # The bot is only used to edit progress messages
+    async with Bot(config.BOT_TOKEN) as bot:
+        worker = JobWorker(bot)
+        worker.start()
+        await stop_event.wait()
+        logger.info("Stopping worker...")
+        await worker.stop()
+        shutdown_executor()
+
+if __name__ == '__main__':
+    asyncio.run(run_worker())